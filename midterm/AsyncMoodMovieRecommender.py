@@ -0,0 +1,392 @@
+import asyncio
+import time
+
+import httpx
+import openai
+
+from CandidateIndex import PAGE_SIZE
+from Deadline import Deadline
+from MoodMovieRecommender import (EMBEDDING_MODEL, OPENAI_API_KEY, STREAMING_PENDING, TMDB_API_KEY, TMDB_TIMEOUT,
+                                  MoodMovieRecommender)
+from RecommendationResult import MovieInfo, RecommendationResult
+from ResponseCache import ResponseCache
+from TMDBClient import AsyncTMDBClient
+
+
+class AsyncMoodMovieRecommender:
+    """asyncio counterpart of MoodMovieRecommender for services that run many sessions on one event loop.
+
+    Prompts, response parsing, caches and the candidate index are shared with a
+    MoodMovieRecommender (the engine); only the OpenAI and TMDB calls are async, so a
+    recommendation never ties up a thread while it waits on the network.
+    """
+
+    def __init__(self, engine=None, tmdb=None, client=None):
+        self.engine = engine if engine is not None else MoodMovieRecommender()
+        self.client = client if client is not None else openai.AsyncOpenAI(api_key=OPENAI_API_KEY)
+        self.tmdb = tmdb if tmdb is not None else AsyncTMDBClient(
+            TMDB_API_KEY, pool_size=self.engine.max_workers, timeout=(3.05, TMDB_TIMEOUT), metrics=self.engine.metrics,
+            rate_limiter=self.engine.tmdb.rate_limiter)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        """Close the HTTP clients"""
+        await self.tmdb.aclose()
+        await self.client.close()
+
+    async def _cached(self, cache, namespace, key_parts, loader, validate=None):
+        """Async ResponseCache.get_or_set: await loader() on a miss and cache its result (if validate allows).
+
+        Cache lookups run inline; the memory backend never blocks and SQLite lookups are
+        local-disk reads.
+        """
+        found, value = cache.get(namespace, key_parts)
+        if found:
+            return value
+
+        value = await loader()
+        if validate is None or validate(value):
+            cache.set(namespace, key_parts, value)
+        return value
+
+    async def _complete(self, messages, cache_namespace=None, cache_key=None, until=None, validate=None, **options):
+        """Run a chat completion and return its text, reusing a cached completion when allowed.
+
+        With until (a time.monotonic() deadline) it raises asyncio.TimeoutError if the
+        completion isn't ready by then. With validate, only completions for which
+        validate(text) is true are cached.
+        """
+        if until is not None:
+            return await asyncio.wait_for(
+                self._complete(messages, cache_namespace, cache_key, validate=validate, **options),
+                Deadline.left(until))
+
+        async def create():
+            with self.engine.metrics.span("openai.chat", stage=cache_namespace or "chat"):
+                response = await self.client.chat.completions.create(
+                    model=self.engine.model,
+                    messages=messages,
+                    **options
+                )
+            self.engine.metrics.record_usage(self.engine.model, response.usage)
+            return response.choices[0].message.content
+
+        if cache_namespace is None or not self.engine.use_llm_cache:
+            return await create()
+        return await self._cached(self.engine.llm_cache, cache_namespace, cache_key, create, validate)
+
+    async def analyze_quiz_results(self, answers, context=None):
+        """Use AI to analyze quiz answers, setting the session's profile and returning its summary"""
+        engine = self.engine
+        context = engine._session(context)
+        start = time.perf_counter()
+        context.genre_ids = None
+        context.fallback_profile = False
+
+        with engine.metrics.span("quiz", mode=engine.profile_mode):
+            parsed = None
+            if engine.single_call_profile:
+                messages = engine._profile_and_summary_messages(answers)
+                content = await self._complete(
+                    messages, "quiz_profile_summary", engine._llm_cache_key(messages, answers),
+                    validate=lambda text: engine._parse_profile_and_summary(text) is not None,
+                    response_format={"type": "json_object"})
+                parsed = engine._parse_profile_and_summary(content)
+                if parsed is None:
+                    print("Error parsing AI response. Requesting the profile and summary separately.")
+
+            if parsed is not None:
+                context.user_profile, context.quiz_results = parsed
+            else:
+                messages = engine._quiz_profile_messages(answers)
+                profile_text = await self._complete(messages, "quiz_profile", engine._llm_cache_key(messages, answers),
+                                                    validate=lambda text: engine._load_profile_json(text) is not None)
+                context.user_profile = engine._parse_user_profile(profile_text, context)
+
+                messages = engine._profile_summary_messages(context)
+                context.quiz_results = await self._complete(
+                    messages, "profile_summary", engine._llm_cache_key(messages, context.user_profile))
+
+        engine._record_profile_timing(start)
+        return context.quiz_results
+
+    async def search_tmdb_movies(self, page=1, context=None):
+        """Discover movies for the session's genres and mood, from the local index or TMDB"""
+        params = self.engine._discover_params(self.engine._session(context), page)
+
+        with self.engine.metrics.span("discover"):
+            # Answer from the local index when it fills the page, skipping the network round-trip.
+            # The index is a capped crawl, so a short page may be missing movies TMDB would return
+            index = self.engine.candidate_index.get()
+            if index is not None:
+                movies_data = index.discover(params)
+                if len(movies_data["results"]) == PAGE_SIZE:
+                    self.engine.metrics.count("index_hits_total")
+                    return movies_data
+
+            try:
+                return await self._cached(self.engine.cache, "discover", params,
+                                          lambda: self.tmdb.get("/discover/movie", params))
+            except httpx.HTTPError as e:
+                print(f"Error connecting to TMDB API: {e}")
+                return {"results": []}
+
+    async def hydrate_movie(self, movie_id):
+        """Fetch details, credits and watch providers for a movie in one request (None on failure)"""
+        async def load():
+            details = await self.tmdb.get(f"/movie/{movie_id}", {"append_to_response": "credits,watch/providers"})
+            return self.engine._compact_movie(details)
+
+        try:
+            return MovieInfo(**await self._cached(self.engine.cache, "movie", movie_id, load))
+        except httpx.HTTPError as e:
+            print(f"Error getting movie details: {e}")
+            return None
+
+    async def recommend_movies(self, context=None, deadline=None):
+        """Generate movie recommendations based on the session's profile and current mood.
+
+        deadline (a Deadline, by default one of the configured budget) bounds how long
+        each stage may take; stages that run out of time leave notes on the result.
+        """
+        context = self.engine._session(context)
+        context.deadline = deadline if deadline is not None else self.engine.start_deadline()
+        with self.engine.metrics.span("recommend"):
+            await self._recommend(context)
+        return self.engine._with_notes(context)
+
+    async def _recommend(self, context):
+        """Body of recommend_movies, run inside its span"""
+        engine = self.engine
+        detailed_movies, message = await self._prepare_candidates(context)
+
+        if not detailed_movies:
+            context.last_recommendation = RecommendationResult(message)
+            return context.last_recommendation
+
+        # Store detailed_movies on the session so it's available in get_streaming_availability
+        context.detailed_movies = detailed_movies
+
+        until = context.deadline.until("select") if context.deadline is not None else None
+        with engine.metrics.span("select"):
+            try:
+                if engine.structured_output:
+                    messages, prompt_movies = engine._recommendation_messages(detailed_movies, context,
+                                                                              structured=True)
+                    if not prompt_movies:
+                        context.last_recommendation = engine._fallback_ranking(detailed_movies, context,
+                                                                               over_budget=True)
+                        return context.last_recommendation
+                    content = await self._complete(messages, "recommendation_json",
+                                                   engine._recommendation_cache_key(messages, prompt_movies, context),
+                                                   until=until,
+                                                   validate=lambda text: engine._parse_picks(text) is not None,
+                                                   response_format=engine.recommendation_format)
+                    context.last_recommendation = engine._render_structured_picks(content, prompt_movies, context)
+                else:
+                    messages, prompt_movies = engine._recommendation_messages(detailed_movies, context)
+                    if not prompt_movies:
+                        context.last_recommendation = engine._fallback_ranking(detailed_movies, context,
+                                                                               over_budget=True)
+                        return context.last_recommendation
+                    recommendations = await self._complete(
+                        messages, "recommendation", engine._recommendation_cache_key(messages, prompt_movies, context),
+                        until=until)
+                    context.last_recommendation = engine._match_recommended_movies(recommendations, prompt_movies,
+                                                                                   context)
+            except (asyncio.TimeoutError, openai.APIConnectionError):
+                # Without a deadline there's nothing to fall back to
+                if until is None:
+                    raise
+                context.last_recommendation = engine._fallback_ranking(detailed_movies, context)
+        return context.last_recommendation
+
+    async def _prepare_candidates(self, context):
+        """Find and hydrate candidate movies, returning (detailed_movies, message if there are none)"""
+        if not context.user_profile or not context.current_mood:
+            return [], "Please complete the personality quiz and share your mood first."
+
+        until = context.deadline.until("candidates") if context.deadline is not None else None
+        with self.engine.metrics.span("candidates"):
+            ranker = self.engine.embedding_ranker.get()
+            if ranker is not None:
+                # Pre-rank a wide pool by similarity and hydrate only the best matches
+                movie_ids = await self._prerank_candidates(ranker, context, until)
+                with self.engine.metrics.span("hydrate"):
+                    candidate_details = self.engine._note_late(context, until, await self._gather_until(
+                        [self.hydrate_movie(movie_id) for movie_id in movie_ids], until))
+            else:
+                candidate_details = await self._fetch_candidate_details(context, until)
+
+        if not candidate_details:
+            if context.deadline is not None and "candidates" in context.deadline.missed:
+                return [], "TMDB is responding slowly right now. Please try again in a moment."
+            return [], "No movies found that match your preferences. Please try a different mood."
+
+        detailed_movies = [movie for movie in candidate_details if movie is not None]
+        if not detailed_movies:
+            return [], "Couldn't retrieve detailed movie information. Please try again later."
+        return detailed_movies, None
+
+    async def _fetch_candidate_details(self, context, until=None):
+        """Hydrate up to 10 discover candidates, in discover order, one entry per candidate.
+
+        With until (a time.monotonic() deadline), candidates not hydrated by then are None.
+        """
+        page_one = (await self._gather_until([self.search_tmdb_movies(page=1, context=context)], until))[0]
+        if page_one is None:
+            self.engine._miss(context, "candidates", "TMDB search timed out.")
+            return []
+        results = page_one.get("results", [])
+        hydrations = [asyncio.ensure_future(self.hydrate_movie(movie["id"]))
+                      for movie in self.engine.candidate_results(results)]
+
+        # If we didn't get enough results, fetch page 2 while the page-1 details load. Like the
+        # sync engine it's only requested when needed: a speculative prefetch would cost a TMDB
+        # request (and a rate limit token) on nearly every recommendation
+        if self.engine.needs_page_two(results):
+            more_movies = ((await self._gather_until([self.search_tmdb_movies(page=2, context=context)], until))[0]
+                           or {}).get("results", [])
+            hydrations += [asyncio.ensure_future(self.hydrate_movie(movie["id"]))
+                           for movie in self.engine.candidate_results(results, more_movies)[len(hydrations):]]
+
+        # Gather in creation order so the candidate ranking is unchanged
+        with self.engine.metrics.span("hydrate"):
+            return self.engine._note_late(context, until, await self._gather_until(hydrations, until))
+
+    @staticmethod
+    async def _gather_until(awaitables, until=None):
+        """Results of awaitables in order, waiting until the time.monotonic() deadline until at most.
+
+        Ones still running then are None in the results; they keep running, so their
+        responses still reach the cache for the next request.
+        """
+        tasks = [asyncio.ensure_future(awaitable) for awaitable in awaitables]
+        if until is None:
+            return list(await asyncio.gather(*tasks))
+        if tasks:
+            await asyncio.wait(tasks, timeout=Deadline.left(until))
+        return [task.result() if task.done() else None for task in tasks]
+
+    async def _prerank_candidates(self, ranker, context, until=None):
+        """Pick the top-K movie IDs from a wide candidate pool by embedding similarity to the profile and mood.
+
+        With until, the query embedding gets half of the time left (see MoodMovieRecommender._prerank_candidates).
+        """
+        engine = self.engine
+        pool_ids = await self._candidate_pool(engine.prerank_pool_size, context, until)
+        if not pool_ids:
+            return []
+        embed_until = time.monotonic() + Deadline.left(until) / 2 if until is not None else None
+        query_vector = await self._embed_query(context, embed_until)
+        if query_vector is None:
+            if embed_until is not None and time.monotonic() >= embed_until:
+                engine._miss(context, "candidates",
+                             "Similarity ranking took too long, so candidates are in TMDB's order.")
+            return pool_ids[:engine.prerank_top_k]
+        return ranker.rank(pool_ids, query_vector, engine.prerank_top_k)
+
+    async def _candidate_pool(self, size, context, until=None):
+        """Up to size discover candidate IDs, from the local index or from several discover pages.
+
+        With until (a time.monotonic() deadline), pages not fetched by then are left out.
+        """
+        index = self.engine.candidate_index.get()
+        if index is not None:
+            pool_ids = index.discover_ids(self.engine._discover_params(context), size)
+            if len(pool_ids) >= min(size, PAGE_SIZE):
+                return pool_ids
+
+        # Without an index, fetch up to 5 discover pages (100 candidates) concurrently
+        pages = range(1, min(5, -(-size // 20)) + 1)
+        pages_data = await self._gather_until([self.search_tmdb_movies(page=page, context=context) for page in pages],
+                                              until)
+        if None in pages_data:
+            timed_out = all(data is None for data in pages_data)
+            self.engine._miss(context, "candidates", "TMDB search timed out." if timed_out
+                              else "Only part of the candidate pool loaded in time.")
+        pool_ids = dict.fromkeys(movie["id"] for data in pages_data if data is not None
+                                 for movie in data.get("results", []))
+        return list(pool_ids)[:size]
+
+    async def _embed_query(self, context, until=None):
+        """Embedding of the session's profile and current mood, or None if it can't be computed (by until)"""
+        if until is not None:
+            try:
+                return await asyncio.wait_for(self._embed_query(context), Deadline.left(until))
+            except asyncio.TimeoutError:
+                return None
+
+        text = self.engine._embedding_query_text(context)
+
+        async def create():
+            with self.engine.metrics.span("openai.embedding"):
+                response = await self.client.embeddings.create(model=EMBEDDING_MODEL, input=text)
+            self.engine.metrics.record_usage(EMBEDDING_MODEL, response.usage)
+            return response.data[0].embedding
+
+        try:
+            if not self.engine.use_llm_cache:
+                return await create()
+            return await self._cached(self.engine.llm_cache, "embedding",
+                                      ResponseCache.digest([EMBEDDING_MODEL, text]), create)
+        except openai.OpenAIError as e:
+            print(f"Error creating query embedding: {e}")
+            return None
+
+    async def get_streaming_availability(self, recommendations, context=None, region=None, deadline=None):
+        """Check where the recommended movies are available for streaming using TMDB data.
+
+        With a deadline (by default one of the configured budget), lookups still running
+        when the providers stage runs out of time are shown as not loaded, and the session's
+        last recommendation gets a note saying so.
+        """
+        engine = self.engine
+        context = engine._session(context)
+        context.deadline = deadline if deadline is not None else engine.start_deadline()
+        with engine.metrics.span("providers"):
+            streaming_info = await self._lookup_availability(recommendations, context, region)
+        if context.last_recommendation is not None:
+            engine._with_notes(context)
+        return streaming_info
+
+    async def _lookup_availability(self, recommendations, context, region):
+        """Body of get_streaming_availability, run inside its span"""
+        engine = self.engine
+        until = context.deadline.until("providers") if context.deadline is not None else None
+        if not context.recommended_movie_ids:
+            try:
+                return await self._complete(engine._streaming_guess_messages(recommendations), until=until)
+            except (asyncio.TimeoutError, openai.APIConnectionError):
+                if until is None:
+                    raise
+                engine._miss(context, "providers", "Streaming availability didn't load in time.")
+                return STREAMING_PENDING
+
+        # Hydrated candidates already carry their providers; the rest are fetched concurrently
+        movies = await self._hydrate_batch(context.recommended_movie_ids, context.detailed_movies, until)
+        pending = until is not None and len(movies) < len(context.recommended_movie_ids) and \
+            time.monotonic() >= until
+        if pending:
+            engine._miss(context, "providers", "Streaming availability didn't load in time for every movie.")
+        return engine._availability_text(context.recommended_movie_ids, movies, region or engine.region, pending)
+
+    async def get_providers_batch(self, movie_ids, region=None, movies=()):
+        """Watch providers for many movies at once: {movie ID: {"flatrate": [names], "rent": [names]}}"""
+        region = region or self.engine.region
+        return {movie_id: movie.providers.get(region, {})
+                for movie_id, movie in (await self._hydrate_batch(movie_ids, movies)).items()}
+
+    async def _hydrate_batch(self, movie_ids, movies=(), until=None):
+        """{movie ID: MovieInfo} for movie_ids, hydrating the ones missing from movies concurrently (by until)"""
+        known = {movie.id: movie for movie in movies}
+        missing = [movie_id for movie_id in dict.fromkeys(movie_ids) if movie_id not in known]
+        for movie in await self._gather_until([self.hydrate_movie(movie_id) for movie_id in missing], until):
+            if movie is not None:
+                known[movie.id] = movie
+        return {movie_id: known[movie_id] for movie_id in movie_ids if movie_id in known}
@@ -0,0 +1,304 @@
+import argparse
+import json
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from MoodMovieRecommender import MoodMovieRecommender
+from RateLimiter import RateLimiter
+from ResponseCache import ResponseCache
+from SessionContext import SessionContext
+
+
+class BatchRecommender:
+    """Recommendations for many (profile, mood) pairs at once, e.g. for email digests or A/B evaluation.
+
+    Input records are dicts with a "mood" and either a "profile" (plus optional
+    "summary"), a "user_id" saved in the profile store, or quiz "answers"; an "id" is
+    optional. Records are processed in chunks: identical pairs are computed once, every
+    distinct discover query and candidate movie is fetched once on the recommender's
+    TMDB pool (hydrated movies are kept for the whole batch), and the AI selections
+    run with bounded concurrency on a pool of their own.
+    """
+
+    def __init__(self, recommender=None, llm_concurrency=4, llm_rate=None, tmdb_rate=None, chunk_size=200):
+        self.recommender = recommender if recommender is not None else MoodMovieRecommender()
+        if tmdb_rate:
+            # Shared by every thread that uses the recommender's TMDB client
+            self.recommender.tmdb.rate_limiter = RateLimiter(tmdb_rate)
+        # OpenAI requests per second across the selection workers (None = only bounded by llm_concurrency)
+        self.llm_limiter = RateLimiter(llm_rate) if llm_rate else None
+        self.llm_concurrency = max(1, llm_concurrency)
+        self.chunk_size = max(1, chunk_size)
+        self._movies = {}  # movie ID -> MovieInfo (None if TMDB failed)
+
+    @staticmethod
+    def record_id(record):
+        """The record's "id", or a hash of the record when it has none"""
+        if record.get("id") is not None:
+            return str(record["id"])
+        return ResponseCache.digest(record)[:16]
+
+    def recommend(self, records):
+        """Yield a result dict for every record, in completion order"""
+        # Selections run on their own pool: they wait on TMDB work queued on the recommender's
+        # pool, so running them there could leave no thread free for that work
+        with ThreadPoolExecutor(max_workers=self.llm_concurrency, thread_name_prefix="batch-llm") as pool:
+            chunk = []
+            for record in records:
+                chunk.append(record)
+                if len(chunk) == self.chunk_size:
+                    yield from self._run_chunk(chunk, pool)
+                    chunk = []
+            if chunk:
+                yield from self._run_chunk(chunk, pool)
+
+    def run(self, input_path, output_path, resume=True):
+        """Recommend for every record in a JSON lines file, appending results to output_path as they finish.
+
+        With resume, records that already have a successful result in output_path are
+        skipped, so an interrupted run can be restarted with the same arguments. A record
+        whose id repeats an earlier one in the input fails instead of being processed twice.
+        Returns counts of succeeded, failed and skipped records.
+        """
+        done = self._completed_ids(output_path) if resume else set()
+        first_lines = {}  # record ID -> line it was first seen on in this input
+        stats = Counter()
+
+        with open(output_path, "a" if resume else "w", encoding="utf-8") as f:
+            def write(result):
+                f.write(json.dumps(result) + "\n")
+                f.flush()
+                stats["failed" if result["error"] else "succeeded"] += 1
+
+            def pending():
+                with open(input_path, encoding="utf-8") as source:
+                    for number, line in enumerate(source, 1):
+                        if not line.strip():
+                            continue
+                        # A line that isn't a JSON object fails on its own instead of stopping the batch
+                        try:
+                            record = json.loads(line)
+                        except json.JSONDecodeError as e:
+                            write(self._result({"id": f"line-{number}"}, error=f"Invalid JSON on line {number}: {e}"))
+                            continue
+                        if not isinstance(record, dict):
+                            write(self._result({"id": f"line-{number}"}, error=f"Line {number} is not a JSON object"))
+                            continue
+
+                        record_id = self.record_id(record)
+                        if record_id in first_lines:
+                            write(self._result({"id": f"line-{number}"},
+                                               error=f"Line {number} repeats id {record_id} from line "
+                                                     f"{first_lines[record_id]}, so it wasn't processed"))
+                            continue
+                        first_lines[record_id] = number
+                        if record_id in done:
+                            stats["skipped"] += 1
+                            continue
+                        yield record
+
+            for result in self.recommend(pending()):
+                write(result)
+        return dict(stats)
+
+    @staticmethod
+    def _completed_ids(path):
+        """IDs with a successful result in an output file, dropping a last line cut off by an interruption"""
+        if not os.path.exists(path):
+            return set()
+        with open(path, "rb+") as f:
+            data = f.read()
+            if data and not data.endswith(b"\n"):
+                data = data[:data.rfind(b"\n") + 1]
+                f.truncate(len(data))
+
+        done = set()
+        for line in data.decode("utf-8").splitlines():
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if not result.get("error"):
+                done.add(result["id"])
+        return done
+
+    def _run_chunk(self, records, pool):
+        """Yield the results for one chunk of records"""
+        engine = self.recommender
+
+        # Malformed records fail on their own, before any work is started for them
+        valid = []
+        for record in records:
+            error = self._invalid(record)
+            if error is not None:
+                yield self._result(record if isinstance(record, dict) else {}, error=error)
+            else:
+                valid.append(record)
+        records = valid
+
+        # Resolve each distinct profile once (quiz answers may need the AI)
+        sources = {}
+        for record in records:
+            sources.setdefault(self._profile_source(record), record)
+        futures = {source: pool.submit(self._resolve_profile, record) for source, record in sources.items()}
+
+        # Group records by (profile, mood) so identical pairs are recommended once
+        pairs = {}
+        for record in records:
+            profile_future = futures[self._profile_source(record)]
+            if profile_future.exception() is not None:
+                yield self._result(record, error=str(profile_future.exception()))
+                continue
+
+            profile = profile_future.result()
+            mood = record["mood"].strip()
+            key = ResponseCache.digest([profile.user_profile, mood.lower()])
+            if key not in pairs:
+                pairs[key] = (SessionContext(user_profile=profile.user_profile, quiz_results=profile.quiz_results,
+                                             genre_ids=profile.genre_ids, current_mood=mood), [])
+            pairs[key][1].append(record)
+
+        # With embedding pre-ranking, candidates depend on the whole profile and are found per pair
+        if engine.embedding_ranker.get() is None:
+            candidate_ids = self._fetch_candidates([context for context, _ in pairs.values()])
+        else:
+            candidate_ids = {}
+
+        selections = {pool.submit(self._select, context, candidate_ids.get(id(context))): group
+                      for context, group in pairs.values()}
+        for future in as_completed(selections):
+            error = future.exception()
+            for record in selections[future]:
+                if error is not None:
+                    yield self._result(record, error=f"{type(error).__name__}: {error}")
+                else:
+                    yield self._result(record, *future.result())
+
+    @staticmethod
+    def _invalid(record):
+        """Why a record can't be processed, or None if it looks valid"""
+        if not isinstance(record, dict):
+            return "Record is not a JSON object"
+        mood = record.get("mood")
+        if mood is not None and not isinstance(mood, str):
+            return "Record's mood must be a string"
+        if not mood or not mood.strip():
+            return "Record has no mood"
+        for field in ("profile", "answers"):
+            if record.get(field) is not None and not isinstance(record[field], dict):
+                return f"Record's {field} must be a JSON object"
+        return None
+
+    @staticmethod
+    def _profile_source(record):
+        """Key of what a record's profile comes from, shared by records with the same profile"""
+        return ResponseCache.digest([record.get("profile"), record.get("summary"), record.get("user_id"),
+                                     record.get("answers")])
+
+    def _resolve_profile(self, record):
+        """Session holding the record's profile: given inline, saved in the profile store, or analyzed from answers"""
+        engine = self.recommender
+        context = SessionContext()
+        if record.get("profile"):
+            context.user_profile = record["profile"]
+            context.quiz_results = record.get("summary", "")
+        elif not engine.load_profile(record.get("user_id"), record.get("answers"), context):
+            if not record.get("answers"):
+                raise ValueError("Record needs a profile, a saved user_id or quiz answers")
+            if self.llm_limiter is not None:
+                self.llm_limiter.acquire()
+            engine._analyze_quiz_results(record["answers"], context)
+            # Don't store the default profile used when the AI's couldn't be read
+            if not context.fallback_profile:
+                engine.save_profile(record.get("user_id"), record["answers"], context)
+
+        # Parse the genre IDs once for every pair that uses this profile
+        engine.get_tmdb_genre_ids(context)
+        return context
+
+    def _fetch_candidates(self, contexts):
+        """Fetch each distinct discover query and candidate movie once, returning {id(context): candidate IDs}"""
+        engine = self.recommender
+
+        def fetch_pages(page_params):
+            queries = {ResponseCache.make_key("discover", params): params for params in page_params}
+            results = engine._map_concurrently(engine.discover_movies, queries.values())
+            return {key: data.get("results", []) for key, data in zip(queries, results)}
+
+        first_params = {id(context): engine._discover_params(context) for context in contexts}
+        first_pages = fetch_pages(first_params.values())
+
+        # Like a single recommendation, fall back to page 2 when page 1 is short
+        second_params = {id(context): engine._discover_params(context, 2) for context in contexts
+                         if engine.needs_page_two(
+                             first_pages[ResponseCache.make_key("discover", first_params[id(context)])])}
+        second_pages = fetch_pages(second_params.values())
+
+        candidate_ids = {}
+        for key, params in first_params.items():
+            more_results = []
+            if key in second_params:
+                more_results = second_pages[ResponseCache.make_key("discover", second_params[key])]
+            candidate_ids[key] = [movie["id"] for movie in
+                                  engine.candidate_results(first_pages[ResponseCache.make_key("discover", params)],
+                                                           more_results)]
+
+        missing = list(dict.fromkeys(movie_id for ids in candidate_ids.values() for movie_id in ids
+                                     if movie_id not in self._movies))
+        with engine.metrics.span("hydrate"):
+            self._movies.update(zip(missing, engine._map_concurrently(engine.hydrate_movie, missing)))
+        return candidate_ids
+
+    def _select(self, context, candidate_ids):
+        """Recommend for one pair, returning (RecommendationResult, error message if there is nothing to recommend)"""
+        engine = self.recommender
+        if candidate_ids is None:
+            detailed_movies, message = engine._prepare_candidates(context)
+        else:
+            detailed_movies = [self._movies[movie_id] for movie_id in candidate_ids
+                               if self._movies.get(movie_id) is not None]
+            if not candidate_ids:
+                message = "No movies found that match your preferences. Please try a different mood."
+            else:
+                message = "Couldn't retrieve detailed movie information. Please try again later."
+        if not detailed_movies:
+            return None, message
+
+        if self.llm_limiter is not None:
+            self.llm_limiter.acquire()
+        return engine._analyze_movies_for_mood(detailed_movies, context), None
+
+    def _result(self, record, result=None, error=None):
+        """Output line for a record"""
+        return {
+            "id": self.record_id(record),
+            "user_id": record.get("user_id"),
+            "mood": record.get("mood"),
+            "recommended_ids": list(result.recommended_ids) if result is not None else [],
+            "recommended_titles": [movie.title for movie in result.recommended_movies] if result is not None else [],
+            "explanations": {str(movie_id): text for movie_id, text in result.explanations.items()}
+            if result is not None else {},
+            "text": result.text if result is not None else None,
+            "error": error
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recommend movies for every (profile, mood) record in a JSON lines file")
+    parser.add_argument("input", help="JSON lines file of records with a mood and a profile, user_id or answers")
+    parser.add_argument("output", help="JSON lines file the results are appended to")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="overwrite the output instead of skipping records it already has")
+    parser.add_argument("--llm-concurrency", type=int, default=4, help="OpenAI requests in flight at once")
+    parser.add_argument("--llm-rpm", type=float, help="maximum OpenAI requests per minute")
+    parser.add_argument("--tmdb-rps", type=float, default=35, help="maximum TMDB requests per second")
+    parser.add_argument("--chunk-size", type=int, default=200, help="records deduplicated and fetched together")
+    args = parser.parse_args()
+
+    batch = BatchRecommender(llm_concurrency=args.llm_concurrency,
+                             llm_rate=args.llm_rpm / 60 if args.llm_rpm else None,
+                             tmdb_rate=args.tmdb_rps, chunk_size=args.chunk_size)
+    stats = batch.run(args.input, args.output, resume=not args.no_resume)
+    print(f"{stats.get('succeeded', 0)} succeeded, {stats.get('failed', 0)} failed, "
+          f"{stats.get('skipped', 0)} skipped (already in {args.output})")
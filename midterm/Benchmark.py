@@ -0,0 +1,424 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import platform
+import random
+import re
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from urllib.parse import parse_qsl, urlsplit
+
+import httpx
+import openai
+import requests
+from requests.adapters import BaseAdapter
+
+# Replayed runs need no credentials; set placeholders before the recommender reads its configuration
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("TMDB_API_KEY", "benchmark")
+
+from AsyncMoodMovieRecommender import AsyncMoodMovieRecommender
+from CandidateIndex import IndexFile
+from EmbeddingRanker import EmbeddingRanker
+from Instrumentation import Instrumentation
+from MoodMovieRecommender import MoodMovieRecommender
+from RateLimiter import RateLimiter
+from ResponseCache import MemoryCacheBackend, ResponseCache
+from SessionContext import SessionContext
+from TMDBClient import AsyncTMDBClient
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "benchmark_fixtures.json")
+SCENARIOS = ("quiz", "recommend", "full")
+MOODS = ["happy", "sad", "relaxed", "excited", "thoughtful", "nostalgic"]
+QUIZ_ANSWERS = {
+    "q1": "Slow-paced character studies, mostly",
+    "q2": "Happy endings, but I like a bit of realism",
+    "q3": "Forrest Gump, Amélie, Good Will Hunting",
+    "q4": "Movies that make me think",
+    "q5": "Modern cinema",
+    "q6": "Horror",
+    "q7": "Yes, especially French and Italian films",
+    "q8": "With others"
+}
+
+
+class FixtureReplay:
+    """Answers TMDB and OpenAI requests from recorded fixtures after an injected latency"""
+
+    def __init__(self, fixtures, tmdb_latency=0.0, openai_latency=0.0):
+        self.tmdb = fixtures["tmdb"]
+        self.openai = fixtures["openai"]
+        self.tmdb_latency = tmdb_latency
+        self.openai_latency = openai_latency
+
+    def tmdb_response(self, url):
+        """(status, body) for a TMDB URL"""
+        parts = urlsplit(url)
+        path = parts.path.split("/3", 1)[-1]
+        params = dict(parse_qsl(parts.query))
+
+        if path == "/discover/movie":
+            page = self.tmdb["discover_pages"].get(params.get("page", "1"))
+            return 200, page or {"page": int(params.get("page", 1)), "results": [], "total_pages": 0,
+                                 "total_results": 0}
+
+        segments = path.strip("/").split("/")
+        movie = self.tmdb["movies"].get(segments[1]) if len(segments) > 1 and segments[0] == "movie" else None
+        if movie is None:
+            return 404, {"status_code": 34, "status_message": "The resource you requested could not be found."}
+        if path.endswith("/watch/providers"):
+            return 200, {"id": movie["id"], "results": movie["watch/providers"]["results"]}
+        return 200, movie
+
+    def openai_response(self, request):
+        """httpx.Response for an OpenAI chat completion or embeddings request"""
+        body = json.loads(request.content)
+        if request.url.path.endswith("/embeddings"):
+            texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            data = [{"object": "embedding", "index": i, "embedding": self._embedding(text)}
+                    for i, text in enumerate(texts)]
+            return httpx.Response(200, json={"object": "list", "data": data, "model": body["model"],
+                                             "usage": {"prompt_tokens": 8 * len(texts), "total_tokens": 8 * len(texts)}})
+
+        text = self._completion_text(body)
+        usage = self.openai["usage"]
+        if body.get("stream"):
+            # One chunk per word, then the usage chunk requested with include_usage
+            chunks = [{"choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]}
+                      for word in re.findall(r"\S+\s*", text)]
+            chunks.append({"choices": [], "usage": usage})
+            events = "".join("data: " + json.dumps({"id": "replay", "object": "chat.completion.chunk", "created": 0,
+                                                    "model": body["model"], **chunk}) + "\n\n" for chunk in chunks)
+            return httpx.Response(200, content=(events + "data: [DONE]\n\n").encode("utf-8"),
+                                  headers={"content-type": "text/event-stream"})
+
+        return httpx.Response(200, json={
+            "id": "replay", "object": "chat.completion", "created": 0, "model": body["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": usage
+        })
+
+    def _completion_text(self, body):
+        """Recorded answer for the kind of chat request in body"""
+        response_format = (body.get("response_format") or {}).get("type")
+        system_prompt = body["messages"][0]["content"]
+
+        recommending = "film recommender" in system_prompt
+        if response_format == "json_schema" or (response_format == "json_object" and recommending):
+            return json.dumps({"recommendations": [{"id": movie_id, "explanation": "Matches your taste and mood."}
+                                                   for movie_id in self.openai["recommendation_ids"]]})
+        if response_format == "json_object":
+            return json.dumps({"profile": self.openai["quiz_profile"], "summary": self.openai["profile_summary"]})
+        if "film expert" in system_prompt:
+            return json.dumps(self.openai["quiz_profile"])
+        if "summarize people's movie preferences" in system_prompt:
+            return self.openai["profile_summary"]
+        if "streaming availability" in system_prompt:
+            return self.openai["streaming_guess"]
+        return self.openai["recommendation"]
+
+    def _embedding(self, text):
+        """Deterministic pseudo-embedding for a text"""
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+        rng = random.Random(seed)
+        return [rng.uniform(-1, 1) for _ in range(self.openai["embedding_dimensions"])]
+
+
+class ReplayTMDBAdapter(BaseAdapter):
+    """requests transport adapter serving TMDB from a FixtureReplay"""
+
+    def __init__(self, replay):
+        super().__init__()
+        self.replay = replay
+
+    def send(self, request, **kwargs):
+        time.sleep(self.replay.tmdb_latency)
+        status, body = self.replay.tmdb_response(request.url)
+
+        response = requests.Response()
+        response.status_code = status
+        response.url = request.url
+        response.request = request
+        response.headers["Content-Type"] = "application/json"
+        response._content = json.dumps(body).encode("utf-8")
+        return response
+
+    def close(self):
+        pass
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of values"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def new_context(scenario, i, fixtures):
+    """Session for request i; the recommend scenario starts from a finished quiz"""
+    context = SessionContext(current_mood=MOODS[i % len(MOODS)])
+    if scenario == "recommend":
+        context.user_profile = dict(fixtures["openai"]["quiz_profile"])
+        context.quiz_results = fixtures["openai"]["profile_summary"]
+    return context
+
+
+def build_recommender(replay, max_workers, use_cache, metrics, tmdb_rate=0):
+    """A MoodMovieRecommender wired to the fixture replay instead of the network"""
+    def cache():
+        # A zero-entry store evicts on every write, so nothing is ever reused
+        return ResponseCache(MemoryCacheBackend(max_entries=2048 if use_cache else 0), metrics=metrics)
+
+    recommender = MoodMovieRecommender(max_workers=max_workers, cache=cache(), llm_cache=cache(),
+                                       use_llm_cache=use_cache, metrics=metrics)
+    recommender.model = recommender.model or "gpt-4o-mini"
+    # Replayed TMDB responses aren't rate limited, so only throttle when asked to
+    recommender.tmdb.rate_limiter = RateLimiter(tmdb_rate) if tmdb_rate else None
+    adapter = ReplayTMDBAdapter(replay)
+    recommender.tmdb.session.mount("https://", adapter)
+    recommender.tmdb.session.mount("http://", adapter)
+
+    def handle(request):
+        time.sleep(replay.openai_latency)
+        return replay.openai_response(request)
+
+    recommender.client = openai.OpenAI(api_key="benchmark", max_retries=0,
+                                       http_client=httpx.Client(transport=httpx.MockTransport(handle)))
+
+    # Replay the network path only, whatever index files exist locally
+    missing = os.path.join(tempfile.gettempdir(), "cinemood-benchmark-missing.npz")
+    recommender.candidate_index = IndexFile(missing)
+    recommender.embedding_ranker = IndexFile(missing, EmbeddingRanker.load)
+    return recommender
+
+
+def build_async_recommender(replay, engine):
+    """An AsyncMoodMovieRecommender around engine, wired to the fixture replay"""
+    async def handle_tmdb(request):
+        await asyncio.sleep(replay.tmdb_latency)
+        status, body = replay.tmdb_response(str(request.url))
+        return httpx.Response(status, json=body)
+
+    async def handle_openai(request):
+        await asyncio.sleep(replay.openai_latency)
+        return replay.openai_response(request)
+
+    tmdb = AsyncTMDBClient("benchmark", pool_size=engine.max_workers, transport=httpx.MockTransport(handle_tmdb),
+                           metrics=engine.metrics, rate_limiter=engine.tmdb.rate_limiter)
+    client = openai.AsyncOpenAI(api_key="benchmark", max_retries=0,
+                                http_client=httpx.AsyncClient(transport=httpx.MockTransport(handle_openai)))
+    return AsyncMoodMovieRecommender(engine, tmdb=tmdb, client=client)
+
+
+def run_scenario(recommender, scenario, context):
+    """One sync request: quiz analysis and/or recommendations plus streaming availability"""
+    if scenario in ("quiz", "full"):
+        recommender._analyze_quiz_results(QUIZ_ANSWERS, context)
+    if scenario in ("recommend", "full"):
+        result = recommender.recommend_movies(context)
+        recommender.get_streaming_availability(result, context)
+
+
+async def run_scenario_async(recommender, scenario, context):
+    """One async request, like run_scenario"""
+    if scenario in ("quiz", "full"):
+        await recommender.analyze_quiz_results(QUIZ_ANSWERS, context)
+    if scenario in ("recommend", "full"):
+        result = await recommender.recommend_movies(context)
+        await recommender.get_streaming_availability(result, context)
+
+
+def summarize(scenario, mode, concurrency, outcomes, wall_seconds, peak_memory):
+    """Aggregate per-request (latency, trace, error) outcomes into one result row"""
+    latencies = [latency * 1000 for latency, _, _ in outcomes]
+    traces = [trace for _, trace, _ in outcomes]
+    count = len(outcomes)
+
+    def per_request(predicate):
+        return sum(1 for trace in traces for span in trace.spans if predicate(span["name"])) / count
+
+    def counter(name):
+        return sum(trace.counters.get(name, 0) for trace in traces)
+
+    hits, misses = counter("cache_hits_total"), counter("cache_misses_total")
+    return {
+        "scenario": scenario,
+        "mode": mode,
+        "concurrency": concurrency,
+        "requests": count,
+        "errors": sum(1 for _, _, error in outcomes if error),
+        "wall_seconds": round(wall_seconds, 4),
+        "throughput_rps": round(count / wall_seconds, 3) if wall_seconds else None,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "mean": round(sum(latencies) / count, 2),
+            "max": round(max(latencies), 2)
+        },
+        "calls_per_request": {
+            "tmdb": round(per_request(lambda name: name == "tmdb.request"), 2),
+            "openai": round(per_request(lambda name: name.startswith("openai.")), 2)
+        },
+        "tokens_per_request": round(counter("openai_tokens_total") / count, 1),
+        "cache_hit_rate": round(hits / (hits + misses), 3) if hits + misses else None,
+        "peak_memory_kb": round(peak_memory / 1024, 1) if peak_memory is not None else None
+    }
+
+
+def benchmark_sync(replay, fixtures, scenario, concurrency, args):
+    metrics = Instrumentation()
+    recommender = build_recommender(replay, args.max_workers, args.cache, metrics, args.tmdb_rps)
+
+    def one(i):
+        context = new_context(scenario, i, fixtures)
+        error = None
+        start = time.perf_counter()
+        with metrics.trace(scenario) as trace:
+            try:
+                run_scenario(recommender, scenario, context)
+            except Exception as e:
+                error = repr(e)
+        return time.perf_counter() - start, trace, error
+
+    for i in range(args.warmup):
+        one(i)
+
+    if args.memory:
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        outcomes = list(pool.map(one, range(args.requests)))
+    wall_seconds = time.perf_counter() - start
+    peak_memory = tracemalloc.get_traced_memory()[1] if args.memory else None
+
+    recommender.tmdb.close()
+    return summarize(scenario, "sync", concurrency, outcomes, wall_seconds, peak_memory)
+
+
+def benchmark_async(replay, fixtures, scenario, concurrency, args):
+    metrics = Instrumentation()
+    engine = build_recommender(replay, args.max_workers, args.cache, metrics, args.tmdb_rps)
+
+    async def main():
+        recommender = build_async_recommender(replay, engine)
+        limit = asyncio.Semaphore(concurrency)
+
+        async def one(i):
+            context = new_context(scenario, i, fixtures)
+            error = None
+            async with limit:
+                start = time.perf_counter()
+                with metrics.trace(scenario) as trace:
+                    try:
+                        await run_scenario_async(recommender, scenario, context)
+                    except Exception as e:
+                        error = repr(e)
+                return time.perf_counter() - start, trace, error
+
+        for i in range(args.warmup):
+            await one(i)
+
+        if args.memory:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        outcomes = await asyncio.gather(*(one(i) for i in range(args.requests)))
+        wall_seconds = time.perf_counter() - start
+        peak_memory = tracemalloc.get_traced_memory()[1] if args.memory else None
+
+        await recommender.aclose()
+        return outcomes, wall_seconds, peak_memory
+
+    outcomes, wall_seconds, peak_memory = asyncio.run(main())
+    return summarize(scenario, "async", concurrency, outcomes, wall_seconds, peak_memory)
+
+
+def git_commit():
+    """Current git commit of the checkout, if there is one"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(runs, previous_path):
+    """Print p50/p95 and throughput changes against a previous results file"""
+    with open(previous_path, encoding="utf-8") as f:
+        previous = {(run["scenario"], run["mode"], run["concurrency"]): run for run in json.load(f)["runs"]}
+
+    print(f"\nChange vs {previous_path}:")
+    for run in runs:
+        before = previous.get((run["scenario"], run["mode"], run["concurrency"]))
+        if before is None:
+            continue
+        deltas = [f"{key} {(run['latency_ms'][key] / before['latency_ms'][key] - 1) * 100:+.1f}%"
+                  for key in ("p50", "p95") if before["latency_ms"][key]]
+        if before["throughput_rps"]:
+            deltas.append(f"throughput {(run['throughput_rps'] / before['throughput_rps'] - 1) * 100:+.1f}%")
+        print(f"  {run['scenario']:<9} {run['mode']:<5} c={run['concurrency']:<4} " + ", ".join(deltas))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the recommender offline against recorded TMDB/OpenAI responses")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--modes", nargs="+", choices=("sync", "async"), default=["sync"])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=32, help="measured requests per run")
+    parser.add_argument("--warmup", type=int, default=2, help="unmeasured requests before each run")
+    parser.add_argument("--tmdb-latency", type=float, default=0.05, help="injected seconds per TMDB request")
+    parser.add_argument("--openai-latency", type=float, default=0.4, help="injected seconds per OpenAI request")
+    parser.add_argument("--tmdb-rps", type=float, default=0,
+                        help="TMDB requests per second allowed by the rate limiter (0 = unlimited)")
+    parser.add_argument("--max-workers", type=int, default=8, help="TMDB pool size (TMDB_MAX_WORKERS)")
+    parser.add_argument("--cache", action="store_true", help="enable the TMDB and AI response caches")
+    parser.add_argument("--memory", action=argparse.BooleanOptionalAction, default=True,
+                        help="track peak memory with tracemalloc (slows the run down)")
+    parser.add_argument("--fixtures", default=FIXTURES_PATH)
+    parser.add_argument("--out", default="benchmark_results.json")
+    parser.add_argument("--compare", help="previous results file to compare against")
+    args = parser.parse_args()
+
+    with open(args.fixtures, encoding="utf-8") as f:
+        fixtures = json.load(f)
+    replay = FixtureReplay(fixtures, args.tmdb_latency, args.openai_latency)
+
+    if args.memory:
+        tracemalloc.start()
+
+    runs = []
+    benchmarks = {"sync": benchmark_sync, "async": benchmark_async}
+    for scenario in args.scenarios:
+        for mode in args.modes:
+            for concurrency in args.concurrency:
+                run = benchmarks[mode](replay, fixtures, scenario, concurrency, args)
+                runs.append(run)
+                latency = run["latency_ms"]
+                print(f"{scenario:<9} {mode:<5} c={concurrency:<4} p50={latency['p50']:>8.1f}ms "
+                      f"p95={latency['p95']:>8.1f}ms p99={latency['p99']:>8.1f}ms "
+                      f"{run['throughput_rps']:>7.2f} req/s  tmdb={run['calls_per_request']['tmdb']:<5} "
+                      f"openai={run['calls_per_request']['openai']:<4} errors={run['errors']}")
+
+    results = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("out", "compare")},
+        "runs": runs
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote {args.out}")
+
+    if args.compare:
+        compare(runs, args.compare)
+
+
+if __name__ == "__main__":
+    main()
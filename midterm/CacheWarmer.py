@@ -0,0 +1,162 @@
+import argparse
+import contextvars
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from MoodMovieRecommender import (CACHE_WARM_RATE, CACHE_WARM_WORKERS, PRESET_MOODS, TMDB_CACHE_BACKEND,
+                                  MoodMovieRecommender)
+from RateLimiter import RateLimiter
+
+# Genre combinations that quiz profiles commonly lead with (TMDB genre IDs)
+COMMON_GENRES = [
+    (18, 35, 28),  # Drama, Comedy, Action (used when the profile's genres can't be read)
+    (18, 35),  # Drama, Comedy (the fallback profile)
+    (18, 35, 10749),  # Drama, Comedy, Romance
+    (28, 12, 878),  # Action, Adventure, Science Fiction
+    (28, 80, 53),  # Action, Crime, Thriller
+    (18, 80, 53),  # Drama, Crime, Thriller
+    (27, 53, 9648),  # Horror, Thriller, Mystery
+    (878, 53, 9648),  # Science Fiction, Thriller, Mystery
+    (16, 35, 10751),  # Animation, Comedy, Family
+    (12, 14, 10751),  # Adventure, Fantasy, Family
+    (18, 36, 10752),  # Drama, History, War
+    (18, 10749, 10402),  # Drama, Romance, Music
+    (35, 80, 28),  # Comedy, Crime, Action
+    (12, 14, 28),  # Adventure, Fantasy, Action
+]
+
+# Decade preferences the discover query distinguishes ("" = no release date filter)
+DECADE_FILTERS = ["", "modern", "classic", "90s"]
+
+
+class CacheWarmer:
+    """Prefetches discover results and hydrated candidates for the preset moods.
+
+    Every (mood x genre combination x decade filter) query a preset-mood click can make
+    is fetched into the recommender's cache, so those clicks only wait on the AI
+    selection. Entries are refreshed on each run, which restarts their TTL; run it at
+    least as often as the discover TTL (6 hours) and use the SQLite cache backend to
+    share the results with other processes.
+
+    Requests run on a small pool of the warmer's own and wait on its own rate limiter
+    (as well as the recommender's), so a run never ties up the recommender's TMDB pool
+    or takes more than rate requests per second of the shared budget from user clicks.
+    """
+
+    def __init__(self, recommender, moods=None, genres=None, decades=None, candidates=10, interval=3 * 60 * 60,
+                 rate=CACHE_WARM_RATE, workers=CACHE_WARM_WORKERS):
+        self.recommender = recommender
+        self.moods = list(moods or PRESET_MOODS)
+        self.genres = list(genres or COMMON_GENRES)
+        self.decades = list(decades if decades is not None else DECADE_FILTERS)
+        self.candidates = candidates
+        self.interval = interval
+        self.rate_limiter = RateLimiter(rate) if rate > 0 else None
+        self.workers = max(1, workers)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def queries(self):
+        """Distinct discover queries for every combination (moods sharing a sort share a query)"""
+        queries = {}
+        for mood, genre_ids, decade in itertools.product(self.moods, self.genres, self.decades):
+            params = self.recommender.discover_params(list(genre_ids), mood, decade)
+            queries.setdefault(tuple(sorted(params.items())), params)
+        return list(queries.values())
+
+    def warm(self):
+        """Refresh every query and its candidates in the cache, returning counts for the run"""
+        recommender = self.recommender
+        start = time.perf_counter()
+        stats = {"queries": 0, "movies": 0, "failed": 0}
+        warmed_ids = set()
+
+        with recommender.metrics.trace("cache_warm"), \
+                ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="cache-warm") as pool:
+            for params in self.queries():
+                results = self._throttled(recommender.discover_movies, params, refresh=True).get("results", [])
+                # Like a recommendation, fall back to page 2 when page 1 is short
+                more_results = []
+                if recommender.needs_page_two(results):
+                    more_results = self._throttled(recommender.discover_movies, {**params, "page": 2},
+                                                   refresh=True).get("results", [])
+                stats["queries"] += 1
+
+                # Candidates shared between queries are only fetched once per run
+                movie_ids = [movie["id"] for movie in
+                             recommender.candidate_results(results, more_results)[:self.candidates]
+                             if movie["id"] not in warmed_ids]
+                warmed_ids.update(movie_ids)
+                with recommender.metrics.span("hydrate"):
+                    futures = [pool.submit(contextvars.copy_context().run, self._throttled,
+                                           recommender.hydrate_movie, movie_id, refresh=True)
+                               for movie_id in movie_ids]
+                    movies = [future.result() for future in futures]
+                stats["movies"] += sum(movie is not None for movie in movies)
+                stats["failed"] += sum(movie is None for movie in movies)
+
+        stats["seconds"] = round(time.perf_counter() - start, 1)
+        return stats
+
+    def _throttled(self, function, *args, **kwargs):
+        """Call function once the warmer's rate limiter allows another TMDB request"""
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        return function(*args, **kwargs)
+
+    def start(self):
+        """Warm the cache now and then every interval seconds on a daemon thread"""
+        if self._thread is not None and self._thread.is_alive():
+            return self._thread
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="cache-warmer", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self, timeout=None):
+        """Stop the background thread after its current run"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                stats = self.warm()
+                print(f"Cache warmed: {stats['queries']} queries, {stats['movies']} movies "
+                      f"({stats['failed']} failed) in {stats['seconds']}s")
+            except Exception as e:
+                print(f"Error warming cache: {e}")
+            self._stop.wait(self.interval)
+
+
+def parse_genres(text):
+    """Genre combinations from text like "18,35,10749;28,12,878\""""
+    return [tuple(int(genre_id) for genre_id in combo.split(",")) for combo in text.split(";") if combo.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prefetch the preset-mood discover queries into the TMDB cache")
+    parser.add_argument("--interval", type=float, default=0,
+                        help="seconds between runs; 0 warms once and exits")
+    parser.add_argument("--moods", help="comma-separated moods (default: the app's preset moods)")
+    parser.add_argument("--genres", type=parse_genres,
+                        help='genre ID combinations, e.g. "18,35,10749;28,12,878" (default: common combinations)')
+    parser.add_argument("--candidates", type=int, default=10, help="movies hydrated per query (at most 10)")
+    parser.add_argument("--rate", type=float, default=CACHE_WARM_RATE,
+                        help="TMDB requests per second the warmer may make (0 = only the shared TMDB_RATE_LIMIT)")
+    parser.add_argument("--workers", type=int, default=CACHE_WARM_WORKERS, help="TMDB requests in flight at once")
+    args = parser.parse_args()
+
+    if TMDB_CACHE_BACKEND.lower() != "sqlite":
+        parser.error("the warmed cache would be lost when this process exits; set TMDB_CACHE_BACKEND=sqlite")
+
+    warmer = CacheWarmer(MoodMovieRecommender(), moods=args.moods.split(",") if args.moods else None,
+                         genres=args.genres, candidates=args.candidates, interval=args.interval,
+                         rate=args.rate, workers=args.workers)
+    if args.interval > 0:
+        warmer._run()
+    else:
+        print(warmer.warm())
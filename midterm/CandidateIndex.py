@@ -0,0 +1,246 @@
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+# TMDB movie genre IDs, in bit order for the genre bitmask
+GENRE_BITS = [28, 12, 16, 35, 80, 99, 18, 10751, 14, 36, 27, 10402, 9648, 10749, 878, 10770, 53, 10752, 37]
+GENRE_TO_BIT = {genre_id: 1 << bit for bit, genre_id in enumerate(GENRE_BITS)}
+
+# Discover sort keys the index can answer, mapped to (column, descending)
+SORT_COLUMNS = {
+    "popularity.desc": ("popularity", True),
+    "vote_average.desc": ("vote_average", True),
+    "vote_count.desc": ("vote_count", True),
+    "primary_release_date.asc": ("release_date", False),
+    "primary_release_date.desc": ("release_date", True),
+}
+
+PAGE_SIZE = 20
+
+
+def _date_to_int(date_text):
+    """Turn "YYYY-MM-DD" into YYYYMMDD (0 when missing)"""
+    digits = (date_text or "").replace("-", "")
+    return int(digits) if len(digits) == 8 and digits.isdigit() else 0
+
+
+def _int_to_date(value):
+    """Turn YYYYMMDD back into "YYYY-MM-DD" ("" when missing)"""
+    if not value:
+        return ""
+    value = int(value)
+    return f"{value // 10000:04d}-{value // 100 % 100:02d}-{value % 100:02d}"
+
+
+class CandidateIndex:
+    """Compact, array-backed store of discover candidates, queried in-process with NumPy.
+
+    Each movie takes 28 bytes: ID, genre bitmask, release date (YYYYMMDD), vote
+    average, vote count and popularity. discover() answers the same parameters the
+    recommender sends to /discover/movie, so the index can stand in for that endpoint.
+    """
+
+    def __init__(self, ids, genre_mask, release_date, vote_average, vote_count, popularity):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.genre_mask = np.asarray(genre_mask, dtype=np.uint32)
+        self.release_date = np.asarray(release_date, dtype=np.int32)
+        self.vote_average = np.asarray(vote_average, dtype=np.float32)
+        self.vote_count = np.asarray(vote_count, dtype=np.int32)
+        self.popularity = np.asarray(popularity, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_movies(cls, movies):
+        """Build an index from discover result dicts (duplicates are dropped)"""
+        unique = {}
+        for movie in movies:
+            unique.setdefault(movie["id"], movie)
+
+        rows = list(unique.values())
+        genre_mask = []
+        for movie in rows:
+            mask = 0
+            for genre_id in movie.get("genre_ids", []):
+                mask |= GENRE_TO_BIT.get(genre_id, 0)
+            genre_mask.append(mask)
+
+        return cls(
+            ids=[movie["id"] for movie in rows],
+            genre_mask=genre_mask,
+            release_date=[_date_to_int(movie.get("release_date")) for movie in rows],
+            vote_average=[movie.get("vote_average", 0) for movie in rows],
+            vote_count=[movie.get("vote_count", 0) for movie in rows],
+            popularity=[movie.get("popularity", 0) for movie in rows]
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Load an index written by save()"""
+        with np.load(path) as data:
+            return cls(data["ids"], data["genre_mask"], data["release_date"],
+                       data["vote_average"], data["vote_count"], data["popularity"])
+
+    def save(self, path):
+        """Write the index to an .npz file (atomically, so running readers never see half a file)"""
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, ids=self.ids, genre_mask=self.genre_mask, release_date=self.release_date,
+                 vote_average=self.vote_average, vote_count=self.vote_count, popularity=self.popularity)
+        os.replace(tmp_path, path)
+
+    def search(self, genre_ids=(), match_all_genres=True, sort_by="popularity.desc",
+               date_gte=None, date_lte=None, min_votes=0):
+        """Return the index positions matching the filters, in sort order"""
+        keep = self.vote_count >= min_votes
+
+        if genre_ids:
+            if any(genre_id not in GENRE_TO_BIT for genre_id in genre_ids):
+                # A genre we don't track can't be answered from the index
+                return np.array([], dtype=np.int64)
+            wanted = 0
+            for genre_id in genre_ids:
+                wanted |= GENRE_TO_BIT[genre_id]
+            wanted = np.uint32(wanted)
+            if match_all_genres:
+                keep &= (self.genre_mask & wanted) == wanted
+            else:
+                keep &= (self.genre_mask & wanted) != 0
+
+        if date_gte:
+            keep &= self.release_date >= _date_to_int(date_gte)
+        if date_lte:
+            keep &= self.release_date <= _date_to_int(date_lte)
+            keep &= self.release_date > 0
+
+        column, descending = SORT_COLUMNS.get(sort_by, SORT_COLUMNS["popularity.desc"])
+        if column == "release_date":
+            # Undated movies (0) would otherwise lead an ascending date sort
+            keep &= self.release_date > 0
+
+        positions = np.flatnonzero(keep)
+        values = getattr(self, column)[positions]
+        order = np.argsort(-values if descending else values, kind="stable")
+        return positions[order]
+
+    def _search_discover_params(self, params):
+        """Run search() for /discover/movie parameters"""
+        genres = str(params.get("with_genres", "") or "")
+        match_all = "|" not in genres
+        genre_ids = [int(genre) for genre in genres.replace("|", ",").split(",") if genre.strip()]
+
+        return self.search(
+            genre_ids=genre_ids,
+            match_all_genres=match_all,
+            sort_by=params.get("sort_by", "popularity.desc"),
+            date_gte=params.get("primary_release_date.gte"),
+            date_lte=params.get("primary_release_date.lte"),
+            min_votes=int(params.get("vote_count.gte", 0))
+        )
+
+    def discover(self, params):
+        """Answer /discover/movie parameters with a discover-shaped response"""
+        positions = self._search_discover_params(params)
+
+        page = int(params.get("page", 1))
+        page_positions = positions[(page - 1) * PAGE_SIZE:page * PAGE_SIZE]
+        return {
+            "page": page,
+            "results": [self.to_result(position) for position in page_positions],
+            "total_results": int(len(positions)),
+            "total_pages": int((len(positions) + PAGE_SIZE - 1) // PAGE_SIZE)
+        }
+
+    def discover_ids(self, params, limit):
+        """Movie IDs for /discover/movie parameters across pages, up to limit, in sort order"""
+        return [int(movie_id) for movie_id in self.ids[self._search_discover_params(params)[:limit]]]
+
+    def to_result(self, position):
+        """Build a discover-style result dict for one index position"""
+        mask = int(self.genre_mask[position])
+        return {
+            "id": int(self.ids[position]),
+            "genre_ids": [genre_id for genre_id in GENRE_BITS if mask & GENRE_TO_BIT[genre_id]],
+            "release_date": _int_to_date(self.release_date[position]),
+            "vote_average": float(self.vote_average[position]),
+            "vote_count": int(self.vote_count[position]),
+            "popularity": float(self.popularity[position])
+        }
+
+    @classmethod
+    def build_from_discover(cls, tmdb, pages=100, sort_keys=tuple(SORT_COLUMNS), min_votes=100, max_workers=8):
+        """Crawl /discover/movie for every sort key and build an index from the results"""
+        def fetch(sort_by, page):
+            try:
+                return tmdb.get("/discover/movie", {"sort_by": sort_by, "page": page,
+                                                    "vote_count.gte": min_votes}).get("results", [])
+            except requests.exceptions.RequestException as e:
+                print(f"Error crawling TMDB discover ({sort_by}, page {page}): {e}")
+                return []
+
+        # TMDB serves at most 500 discover pages per query
+        jobs = [(sort_by, page) for sort_by in sort_keys for page in range(1, min(pages, 500) + 1)]
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            pages_of_movies = list(pool.map(lambda job: fetch(*job), jobs))
+
+        return cls.from_movies(movie for page_movies in pages_of_movies for movie in page_movies)
+
+
+class IndexFile:
+    """Lazily loads an offline-built index file and picks up refreshed versions when the file changes"""
+
+    def __init__(self, path, loader=None, check_interval=60):
+        self.path = path
+        self.loader = loader if loader is not None else CandidateIndex.load
+        self.check_interval = check_interval
+        self._index = None
+        self._mtime = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Return the current index, or None if the file doesn't exist"""
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < self.check_interval:
+            return self._index
+
+        with self._lock:
+            self._checked_at = now
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                self._index, self._mtime = None, None
+                return None
+
+            if mtime != self._mtime:
+                try:
+                    self._index = self.loader(self.path)
+                    self._mtime = mtime
+                except (OSError, ValueError, KeyError) as e:
+                    print(f"Error loading index {self.path}: {e}")
+            return self._index
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    from TMDBClient import TMDBClient
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Build the local TMDB candidate index from discover crawls")
+    parser.add_argument("--out", default=os.getenv("CANDIDATE_INDEX_PATH", "candidate_index.npz"))
+    parser.add_argument("--pages", type=int, default=100, help="discover pages to crawl per sort key")
+    parser.add_argument("--min-votes", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    client = TMDBClient(os.getenv("TMDB_API_KEY"), pool_size=args.workers)
+    index = CandidateIndex.build_from_discover(client, pages=args.pages, min_votes=args.min_votes,
+                                               max_workers=args.workers)
+    index.save(args.out)
+    print(f"Indexed {len(index)} movies into {args.out}")
@@ -0,0 +1,35 @@
+import math
+import time
+
+
+class Deadline:
+    """Latency budget for one request: an overall limit plus a time limit per stage.
+
+    Stages that run out of time return what they have and record a note saying what
+    is partial, which ends up on the RecommendationResult.
+    """
+
+    def __init__(self, budget, stage_timeouts=None):
+        self.expires_at = time.monotonic() + budget
+        self.stage_timeouts = dict(stage_timeouts or {})  # stage name -> seconds
+        self.missed = set()
+        self.notes = []
+
+    def remaining(self):
+        """Seconds left of the overall budget"""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def until(self, stage):
+        """time.monotonic() by which a stage starting now has to finish"""
+        return min(self.expires_at, time.monotonic() + self.stage_timeouts.get(stage, math.inf))
+
+    @staticmethod
+    def left(until):
+        """Seconds until a time.monotonic() deadline (0 once it has passed)"""
+        return max(0.0, until - time.monotonic())
+
+    def miss(self, stage, note):
+        """Record that a stage ran out of time"""
+        self.missed.add(stage)
+        if note not in self.notes:
+            self.notes.append(note)
@@ -0,0 +1,110 @@
+import argparse
+import os
+
+import numpy as np
+
+# Default OpenAI embedding model for movies and queries (both sides must use the same one)
+DEFAULT_EMBEDDING_MODEL = "text-embedding-3-small"
+
+
+def ids_path(path):
+    """Path of the movie ID array that sits next to an embedding matrix"""
+    base, _ = os.path.splitext(path)
+    return f"{base}.ids.npy"
+
+
+def normalize(vectors):
+    """Scale vectors (or a single vector) to unit length so dot products are cosine similarities"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def embed_texts(client, texts, model=DEFAULT_EMBEDDING_MODEL, batch_size=100):
+    """Embed texts with the OpenAI embeddings API, batch_size inputs per request"""
+    vectors = []
+    for start in range(0, len(texts), batch_size):
+        response = client.embeddings.create(model=model, input=texts[start:start + batch_size])
+        vectors.extend(item.embedding for item in sorted(response.data, key=lambda item: item.index))
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def movie_text(movie):
+    """Text embedded for a movie: title, genres and overview"""
+    return f"{movie.title}. Genres: {', '.join(movie.genres)}. {movie.overview}"
+
+
+class EmbeddingRanker:
+    """Cosine-similarity pre-ranking over a precomputed, memory-mapped matrix of movie vectors.
+
+    ids is sorted ascending and row i of vectors (unit length) belongs to ids[i], so
+    candidate lookups are a vectorized binary search and only the rows scored are read
+    from disk.
+    """
+
+    def __init__(self, ids, vectors):
+        self.ids = ids
+        self.vectors = vectors
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_vectors(cls, ids, vectors):
+        """Build a ranker from unsorted IDs and raw embedding vectors"""
+        ids = np.asarray(ids, dtype=np.int64)
+        order = np.argsort(ids, kind="stable")
+        return cls(ids[order], normalize(vectors)[order])
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map an embedding matrix written by save()"""
+        return cls(np.load(ids_path(path)), np.load(path, mmap_mode="r"))
+
+    def save(self, path):
+        """Write the matrix and its IDs (each file is replaced atomically)"""
+        for target, array in ((ids_path(path), self.ids), (path, self.vectors)):
+            tmp_path = f"{target}.tmp.npy"
+            np.save(tmp_path, np.asarray(array))
+            os.replace(tmp_path, target)
+
+    def rank(self, candidate_ids, query_vector, top_k):
+        """Return the top_k candidate IDs by similarity to the query.
+
+        Candidates without a vector rank after every scored one, in their original order.
+        """
+        candidate_ids = np.asarray(candidate_ids, dtype=np.int64)
+        if not len(candidate_ids) or not len(self.ids):
+            return [int(movie_id) for movie_id in candidate_ids[:top_k]]
+
+        rows = np.minimum(np.searchsorted(self.ids, candidate_ids), len(self.ids) - 1)
+        known = self.ids[rows] == candidate_ids
+
+        scores = np.full(len(candidate_ids), -np.inf, dtype=np.float32)
+        scores[known] = np.asarray(self.vectors[rows[known]]) @ normalize(query_vector)
+
+        order = np.argsort(-scores, kind="stable")[:top_k]
+        return [int(movie_id) for movie_id in candidate_ids[order]]
+
+
+if __name__ == "__main__":
+    from CandidateIndex import CandidateIndex
+    from MoodMovieRecommender import EMBEDDINGS_PATH, EMBEDDING_MODEL, CANDIDATE_INDEX_PATH, MoodMovieRecommender
+
+    parser = argparse.ArgumentParser(description="Embed the movies in the candidate index for pre-ranking")
+    parser.add_argument("--index", default=CANDIDATE_INDEX_PATH)
+    parser.add_argument("--out", default=EMBEDDINGS_PATH)
+    parser.add_argument("--limit", type=int, default=None, help="embed only the N most popular movies")
+    args = parser.parse_args()
+
+    index = CandidateIndex.load(args.index)
+    movie_ids = index.ids[np.argsort(-index.popularity, kind="stable")][:args.limit]
+
+    # Hydrate through the recommender so TMDB pooling, retries and caching apply
+    recommender = MoodMovieRecommender()
+    movies = [movie for movie in recommender._hydrate_movies([int(movie_id) for movie_id in movie_ids]) if movie]
+    vectors = embed_texts(recommender.client, [movie_text(movie) for movie in movies], model=EMBEDDING_MODEL)
+
+    ranker = EmbeddingRanker.from_vectors([movie.id for movie in movies], vectors)
+    ranker.save(args.out)
+    print(f"Embedded {len(ranker)} movies into {args.out}")
@@ -0,0 +1,262 @@
+import contextvars
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+# Trace of the request being handled, if any (inherited by asyncio tasks and copied into pool threads)
+_current_trace = contextvars.ContextVar("cinemood_trace", default=None)
+
+
+def endpoint_label(path):
+    """Low-cardinality label for an API path, e.g. "/movie/550/watch/providers" -> "/movie/{id}/watch/providers\""""
+    return re.sub(r"/\d+", "/{id}", path)
+
+
+def _label_key(labels):
+    """Hashable, ordered form of a label dict"""
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Trace:
+    """Spans and counters recorded while handling one request"""
+
+    def __init__(self, name):
+        self.name = name
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.started = time.perf_counter()
+        self.duration = None
+        self.spans = []
+        self.counters = Counter()
+        self._lock = threading.Lock()
+
+    def add_span(self, record):
+        with self._lock:
+            self.spans.append(record)
+
+    def count(self, name, value):
+        with self._lock:
+            self.counters[name] += value
+
+    def summary(self):
+        """Total time and call count per span name, slowest first"""
+        with self._lock:
+            totals = defaultdict(lambda: {"calls": 0, "total_ms": 0.0})
+            for span in self.spans:
+                totals[span["name"]]["calls"] += 1
+                totals[span["name"]]["total_ms"] += span["duration_ms"]
+        rows = [{"span": name, "calls": data["calls"], "total_ms": round(data["total_ms"], 1)}
+                for name, data in totals.items()]
+        return sorted(rows, key=lambda row: row["total_ms"], reverse=True)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "type": "trace",
+                "name": self.name,
+                "trace_id": self.trace_id,
+                "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+                "spans": sorted(self.spans, key=lambda span: span["start_ms"]),
+                "counters": dict(self.counters)
+            }
+
+
+class Instrumentation:
+    """Timing spans, counters and token usage for the recommendation pipeline.
+
+    Aggregates are kept in memory (see snapshot() and to_prometheus()); every finished
+    span and trace is also handed to the exporters.
+    """
+
+    def __init__(self, exporters=(), prefix="cinemood"):
+        self.exporters = list(exporters)
+        self.prefix = prefix
+        self.counters = Counter()  # (name, labels) -> value
+        self.span_stats = {}  # (name, labels) -> [count, total seconds, max seconds]
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **labels):
+        """Time the enclosed block; exceptions are counted as errors and re-raised"""
+        trace = _current_trace.get()
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            key = (name, _label_key(labels))
+            with self._lock:
+                stats = self.span_stats.setdefault(key, [0, 0.0, 0.0])
+                stats[0] += 1
+                stats[1] += duration
+                stats[2] = max(stats[2], duration)
+            if error is not None:
+                self.count("errors_total", span=name, error=error)
+
+            record = {
+                "type": "span",
+                "name": name,
+                "labels": labels,
+                "start_ms": round((start - trace.started) * 1000, 3) if trace is not None else None,
+                "duration_ms": round(duration * 1000, 3),
+                "error": error,
+                "trace_id": trace.trace_id if trace is not None else None
+            }
+            if trace is not None:
+                trace.add_span(record)
+            self._export(record)
+
+    def count(self, name, value=1, **labels):
+        """Add value to a counter (and to the current trace's counters)"""
+        with self._lock:
+            self.counters[(name, _label_key(labels))] += value
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.count(name, value)
+
+    def record_usage(self, model, usage):
+        """Count the tokens reported in an OpenAI response's usage"""
+        if usage is None:
+            return
+        for kind in ("prompt", "completion"):
+            tokens = getattr(usage, f"{kind}_tokens", None)
+            if tokens:
+                self.count("openai_tokens_total", tokens, model=model, kind=kind)
+
+    @contextmanager
+    def trace(self, name):
+        """Collect the spans of the enclosed request into a Trace, which is yielded"""
+        trace = Trace(name)
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            _current_trace.reset(token)
+            trace.duration = time.perf_counter() - trace.started
+            self._export(trace.to_dict())
+            self.flush()
+
+    def _export(self, record):
+        for exporter in self.exporters:
+            try:
+                exporter.export(record)
+            except Exception as e:
+                print(f"Error exporting metrics: {e}")
+
+    def flush(self):
+        """Let exporters that publish aggregates (e.g. Prometheus) write them out"""
+        for exporter in self.exporters:
+            if hasattr(exporter, "flush"):
+                try:
+                    exporter.flush(self)
+                except Exception as e:
+                    print(f"Error exporting metrics: {e}")
+
+    def snapshot(self):
+        """Current aggregates as plain dicts"""
+        with self._lock:
+            return {
+                "spans": [{"name": name, "labels": dict(labels), "count": stats[0],
+                           "total_seconds": stats[1], "max_seconds": stats[2]}
+                          for (name, labels), stats in sorted(self.span_stats.items())],
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in sorted(self.counters.items())]
+            }
+
+    def to_prometheus(self):
+        """Aggregates in the Prometheus text exposition format"""
+        def series(metric, labels):
+            if not labels:
+                return metric
+            text = ",".join(f'{key}="{value}"' for key, value in labels)
+            return f"{metric}{{{text}}}"
+
+        lines = []
+        with self._lock:
+            span_metric = f"{self.prefix}_span_seconds"
+            lines.append(f"# TYPE {span_metric} summary")
+            for (name, labels), stats in sorted(self.span_stats.items()):
+                labels = (("span", name),) + labels
+                lines.append(f"{series(span_metric + '_count', labels)} {stats[0]}")
+                lines.append(f"{series(span_metric + '_sum', labels)} {stats[1]:.6f}")
+
+            typed = set()
+            for (name, labels), value in sorted(self.counters.items()):
+                metric = f"{self.prefix}_{name}"
+                if metric not in typed:
+                    lines.append(f"# TYPE {metric} counter")
+                    typed.add(metric)
+                lines.append(f"{series(metric, labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class LogExporter:
+    """Logs spans (DEBUG) and finished traces (INFO) as JSON through the logging module.
+
+    Without a logger, the "cinemood.metrics" logger is used; if nothing has configured
+    it, it gets a stderr handler and level (INFO: traces only, DEBUG: spans too), since
+    Python's last-resort handler would drop records below WARNING.
+    """
+
+    def __init__(self, logger=None, level=logging.INFO):
+        if logger is None:
+            logger = logging.getLogger("cinemood.metrics")
+            if not logger.handlers:
+                handler = logging.StreamHandler()
+                handler.setFormatter(logging.Formatter("%(asctime)s %(name)s %(message)s"))
+                logger.addHandler(handler)
+                logger.setLevel(level)
+                logger.propagate = False
+        self.logger = logger
+
+    def export(self, record):
+        level = logging.INFO if record["type"] == "trace" else logging.DEBUG
+        self.logger.log(level, json.dumps(record))
+
+
+class JSONLinesExporter:
+    """Appends every span and trace to a JSON lines file"""
+
+    def __init__(self, path="cinemood_metrics.jsonl"):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, record):
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+
+
+class PrometheusExporter:
+    """Writes the aggregates in Prometheus text format, e.g. for node_exporter's textfile collector"""
+
+    def __init__(self, path="cinemood_metrics.prom", interval=15):
+        self.path = path
+        self.interval = interval
+        self._written_at = None
+
+    def export(self, record):
+        # Aggregates are published in flush(); individual spans aren't exported
+        pass
+
+    def flush(self, instrumentation):
+        """Rewrite the file (atomically), at most once per interval seconds"""
+        now = time.monotonic()
+        if self._written_at is not None and now - self._written_at < self.interval:
+            return
+        self._written_at = now
+
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(instrumentation.to_prometheus())
+        os.replace(tmp_path, self.path)
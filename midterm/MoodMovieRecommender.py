@@ -1,28 +1,233 @@
 import os
 import json
+import sqlite3
+import time
+import contextvars
 import openai
 import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
 from dotenv import load_dotenv
 
+from CandidateIndex import PAGE_SIZE, IndexFile
+from Deadline import Deadline
+from EmbeddingRanker import DEFAULT_EMBEDDING_MODEL, EmbeddingRanker
+from Instrumentation import Instrumentation, JSONLinesExporter, LogExporter, PrometheusExporter
+from ProfileStore import ProfileStore, StoredProfile
+from PromptBuilder import PromptBuilder
+from RateLimiter import RateLimiter
+from RecommendationResult import MovieInfo, RecommendationResult
+from ResponseCache import MemoryCacheBackend, ResponseCache, SQLiteCacheBackend
+from SessionContext import SessionContext
+from TMDBClient import TMDBClient
+
 # Load environment variables
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPEN_AI_MODEL = os.getenv("OPEN_AI_MODEL")
 TMDB_API_KEY = os.getenv("TMDB_API_KEY")
+# Maximum number of TMDB requests in flight at once (1 = fetch serially)
+TMDB_MAX_WORKERS = int(os.getenv("TMDB_MAX_WORKERS", "8"))
+# Read timeout in seconds for a single TMDB request
+TMDB_TIMEOUT = float(os.getenv("TMDB_TIMEOUT", "10"))
+# Maximum TMDB requests per second across all sessions of this process (0 = unlimited); TMDB allows about 50
+TMDB_RATE_LIMIT = float(os.getenv("TMDB_RATE_LIMIT", "35"))
+# Where TMDB responses are cached: "memory" (per process) or "sqlite" (on disk, shared)
+TMDB_CACHE_BACKEND = os.getenv("TMDB_CACHE_BACKEND", "memory")
+TMDB_CACHE_PATH = os.getenv("TMDB_CACHE_PATH", "cinemood_cache.sqlite3")
+TMDB_CACHE_MAX_ENTRIES = int(os.getenv("TMDB_CACHE_MAX_ENTRIES", "2048"))
+# Country whose watch providers are shown (ISO 3166-1 code, as used by TMDB)
+TMDB_REGION = os.getenv("TMDB_REGION", "US")
+# Moods offered by the app's mood picker (CacheWarmer prefetches recommendations for them too)
+PRESET_MOODS = ["Happy", "Sad", "Relaxed", "Excited", "Bored", "Stressed", "Thoughtful", "Nostalgic"]
+# Seconds between background runs of CacheWarmer in the app (0 = off); keep it below the 6 hour discover TTL
+CACHE_WARM_INTERVAL = float(os.getenv("CACHE_WARM_INTERVAL", "0"))
+# TMDB requests per second and requests in flight CacheWarmer may use, so it leaves the rest of
+# TMDB_RATE_LIMIT (and the interactive TMDB pool) to user clicks
+CACHE_WARM_RATE = float(os.getenv("CACHE_WARM_RATE", "5"))
+CACHE_WARM_WORKERS = int(os.getenv("CACHE_WARM_WORKERS", "2"))
+# Local candidate index built by CandidateIndex.py; discover queries are answered from it when present
+CANDIDATE_INDEX_PATH = os.getenv("CANDIDATE_INDEX_PATH", "candidate_index.npz")
+# Movie embeddings built by EmbeddingRanker.py; when present, a wide candidate pool is pre-ranked
+# by similarity to the profile and mood and only the top PRERANK_TOP_K movies reach the AI
+EMBEDDINGS_PATH = os.getenv("EMBEDDINGS_PATH", "movie_embeddings.npy")
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL)
+PRERANK_POOL_SIZE = int(os.getenv("PRERANK_POOL_SIZE", "300"))
+PRERANK_TOP_K = int(os.getenv("PRERANK_TOP_K", "8"))
+# Reuse identical OpenAI completions (set LLM_CACHE_ENABLED=0 to always call the API)
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1").lower() not in ("0", "false", "no")
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", "3600"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "512"))
+# Ask the model for recommended TMDB IDs as JSON instead of free text: "json_object" (JSON mode, supported by
+# gpt-4-turbo and later), "json_schema" (strict structured outputs, e.g. gpt-4o) or "0" for the free-text list
+STRUCTURED_OUTPUT = os.getenv("STRUCTURED_OUTPUT", "json_object").lower()
+if STRUCTURED_OUTPUT in ("1", "true", "yes"):
+    STRUCTURED_OUTPUT = "json_schema"
+elif STRUCTURED_OUTPUT in ("0", "false", "no", "off"):
+    STRUCTURED_OUTPUT = ""
+# Build the quiz profile and its summary in one AI request (set to 0 for the original two requests)
+SINGLE_CALL_PROFILE = os.getenv("SINGLE_CALL_PROFILE", "1").lower() not in ("0", "false", "no")
+# Token budget for the candidate-selection prompt; overviews are shortened and low-ranked
+# candidates dropped to stay within it
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "2500"))
+PROMPT_OVERVIEW_CHARS = int(os.getenv("PROMPT_OVERVIEW_CHARS", "240"))
+# SQLite file where quiz profiles are saved so returning users skip the quiz analysis ("" = don't save)
+PROFILE_STORE_PATH = os.getenv("PROFILE_STORE_PATH", "cinemood_profiles.sqlite3")
+# Latency budget in seconds for a recommendation and for its watch providers (0 = wait as long as it takes).
+# Within it each stage gets its own limit; a stage that runs out of time returns partial results
+RECOMMEND_DEADLINE = float(os.getenv("RECOMMEND_DEADLINE", "0"))
+STAGE_TIMEOUTS = {
+    "candidates": float(os.getenv("CANDIDATES_TIMEOUT", "4")),  # TMDB discover and hydration
+    "select": float(os.getenv("SELECT_TIMEOUT", "8")),  # the AI picking the movies
+    "providers": float(os.getenv("PROVIDERS_TIMEOUT", "3")),  # watch provider lookups
+}
+# Where timing spans, counters and token usage are exported: "log", "jsonl", "prometheus" or "" (memory only)
+METRICS_EXPORTER = os.getenv("METRICS_EXPORTER", "")
+METRICS_PATH = os.getenv("METRICS_PATH")  # file for "jsonl" / "prometheus" (defaults to cinemood_metrics.*)
+METRICS_LOG_LEVEL = os.getenv("METRICS_LOG_LEVEL", "INFO").upper()  # "log": INFO logs traces, DEBUG spans too
+
+# "Where to Watch" text shown when the providers stage runs out of time
+STREAMING_PENDING = "Streaming availability couldn't be loaded in time."
+
+# JSON mode response format; the prompt spells out the {"recommendations": [{"id", "explanation"}]} shape
+RECOMMENDATION_JSON_OBJECT = {"type": "json_object"}
+
+# JSON schema for structured recommendation responses
+RECOMMENDATION_SCHEMA = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "movie_recommendations",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "recommendations": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "id": {"type": "integer"},
+                            "explanation": {"type": "string"}
+                        },
+                        "required": ["id", "explanation"],
+                        "additionalProperties": False
+                    }
+                }
+            },
+            "required": ["recommendations"],
+            "additionalProperties": False
+        }
+    }
+}
+
+
+def _context_attribute(name):
+    """Property forwarding a recommender attribute to its default SessionContext"""
+    return property(lambda self: getattr(self.context, name),
+                    lambda self, value: setattr(self.context, name, value))
 
 
 class MoodMovieRecommender:
-    def __init__(self):
+    """Stateless, thread-safe recommendation engine; per-user state lives in a SessionContext"""
+
+    def __init__(self, max_workers=TMDB_MAX_WORKERS, cache=None, llm_cache=None, use_llm_cache=LLM_CACHE_ENABLED,
+                 structured_output=STRUCTURED_OUTPUT, single_call_profile=SINGLE_CALL_PROFILE, region=TMDB_REGION,
+                 metrics=None, profile_store=None, deadline=RECOMMEND_DEADLINE):
+        # Spans, counters and token usage for every TMDB and OpenAI call
+        self.metrics = metrics if metrics is not None else self._create_instrumentation()
         self.client = openai.OpenAI(api_key=OPENAI_API_KEY)
         self.model = OPEN_AI_MODEL
         self.tmdb_api_key = TMDB_API_KEY
         self.tmdb_base_url = "https://api.themoviedb.org/3"
-        self.user_profile = {}
-        self.quiz_results = {}
-        self.current_mood = ""
+        self.max_workers = max(1, max_workers)
+        # Shared pooled session used for every TMDB request, throttled below TMDB's rate limit
+        self.tmdb = TMDBClient(self.tmdb_api_key, self.tmdb_base_url, pool_size=self.max_workers,
+                               timeout=(3.05, TMDB_TIMEOUT), metrics=self.metrics,
+                               rate_limiter=RateLimiter(TMDB_RATE_LIMIT) if TMDB_RATE_LIMIT > 0 else None)
+        # Default watch-provider country
+        self.region = region
+        # Cache for discover pages, movie details and watch providers
+        self.cache = cache if cache is not None else self._create_cache(TMDB_CACHE_MAX_ENTRIES, metrics=self.metrics)
+        # Offline discover index, reloaded whenever the file is rebuilt
+        self.candidate_index = IndexFile(CANDIDATE_INDEX_PATH)
+        self.embedding_ranker = IndexFile(EMBEDDINGS_PATH, EmbeddingRanker.load)
+        self.prerank_pool_size = PRERANK_POOL_SIZE
+        self.prerank_top_k = PRERANK_TOP_K
+        # Cache for OpenAI completions, keyed on a hash of everything that shapes the prompt
+        self.use_llm_cache = use_llm_cache
+        self.llm_cache = llm_cache if llm_cache is not None else self._create_cache(
+            LLM_CACHE_MAX_ENTRIES, table="llm_cache", default_ttl=LLM_CACHE_TTL, metrics=self.metrics)
+        # "json_object", "json_schema" or "" (free text), see STRUCTURED_OUTPUT
+        self.structured_output = structured_output
+        self.prompt_builder = PromptBuilder(PROMPT_TOKEN_BUDGET, PROMPT_OVERVIEW_CHARS, model=self.model)
+        self.single_call_profile = single_call_profile
+        # Default latency budget per request (0 = none) and the limit for each stage within it
+        self.deadline = deadline
+        self.stage_timeouts = dict(STAGE_TIMEOUTS)
+        # Saved quiz profiles, opened on first use
+        self.profile_store = profile_store if profile_store is not None else (
+            ProfileStore(PROFILE_STORE_PATH) if PROFILE_STORE_PATH else None)
+        # Recent quiz analysis durations in seconds, per mode ("single_call" / "two_call")
+        self.profile_timings = {"single_call": deque(maxlen=100), "two_call": deque(maxlen=100)}
+        # Shared pool for concurrent TMDB work, bounded by max_workers across all sessions
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="tmdb")
+        # Session used when callers don't pass their own (single-user and CLI use)
+        self.context = SessionContext()
+
+    # Single-user access to the default session's state
+    user_profile = _context_attribute("user_profile")
+    genre_ids = _context_attribute("genre_ids")
+    quiz_results = _context_attribute("quiz_results")
+    current_mood = _context_attribute("current_mood")
+    detailed_movies = _context_attribute("detailed_movies")
+    recommended_movie_ids = _context_attribute("recommended_movie_ids")
+    last_recommendation = _context_attribute("last_recommendation")
+
+    def _session(self, context):
+        """The given session context, or the recommender's default one"""
+        return context if context is not None else self.context
+
+    def start_deadline(self, budget=None):
+        """A Deadline for one request, starting now (None if there's no budget)"""
+        budget = budget if budget is not None else self.deadline
+        return Deadline(budget, self.stage_timeouts) if budget else None
+
+    def _miss(self, context, stage, note):
+        """Record that a stage ran out of time on the session's deadline"""
+        context.deadline.miss(stage, note)
+        self.metrics.count("deadline_missed_total", stage=stage)
+
+    @staticmethod
+    def _create_cache(max_entries, table="cache", **cache_options):
+        """Build a response cache on the backend configured in the environment"""
+        if TMDB_CACHE_BACKEND.lower() == "sqlite":
+            backend = SQLiteCacheBackend(TMDB_CACHE_PATH, max_entries=max_entries, table=table)
+        else:
+            backend = MemoryCacheBackend(max_entries=max_entries)
+        return ResponseCache(backend, **cache_options)
+
+    @staticmethod
+    def _create_instrumentation():
+        """Build the instrumentation with the exporter configured in the environment"""
+        exporters = {
+            "log": lambda: LogExporter(level=METRICS_LOG_LEVEL),
+            "jsonl": lambda: JSONLinesExporter(METRICS_PATH or "cinemood_metrics.jsonl"),
+            "prometheus": lambda: PrometheusExporter(METRICS_PATH or "cinemood_metrics.prom"),
+        }
+        exporter = exporters.get(METRICS_EXPORTER.lower())
+        return Instrumentation([exporter()] if exporter else [])
 
-    def run_personality_quiz(self):
+    def run_personality_quiz(self, context=None):
         """Run a film taste quiz to understand user preferences"""
+        context = self._session(context)
+        answers = self._ask_quiz_questions()
+
+        # Process quiz results with AI
+        self._analyze_quiz_results(answers, context)
+        return context.quiz_results
+
+    def _ask_quiz_questions(self):
+        """Ask the quiz questions on the command line and collect the answers"""
         questions = [
             "Do you prefer action-packed movies or slow-paced character studies?",
             "Do you enjoy movies with happy endings or prefer more realistic/ambiguous endings?",
@@ -41,51 +246,166 @@ class MoodMovieRecommender:
             answer = input("Your answer: ")
             answers[f"q{i}"] = answer
 
-        # Process quiz results with AI
-        self._analyze_quiz_results(answers)
-        return self.quiz_results
+        return answers
 
-    def _analyze_quiz_results(self, answers):
+    def _analyze_quiz_results(self, answers, context=None):
         """Use AI to analyze quiz answers and create a user profile"""
-        answers_text = "\n".join([f"Q: {k}: {v}" for k, v in answers.items()])
+        context = self._session(context)
+        start = time.perf_counter()
+        context.genre_ids = None
+        context.fallback_profile = False
+
+        with self.metrics.span("quiz", mode=self.profile_mode):
+            if self.single_call_profile:
+                self._build_profile_and_summary(answers, context)
+            else:
+                self._build_user_profile(answers, context)
 
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system", "content": "You are a film expert who can analyze a person's movie preferences. "
-                                              "Create a detailed profile of their film taste based on their quiz answers. "
-                                              "Include their preferred genres, themes, and film qualities. "
-                                              "Structure your response as a JSON object with these keys: "
-                                              "preferred_genres (list of TMDB genre IDs and names), "
-                                              "disliked_genres (list of TMDB genre IDs and names), "
-                                              "tone_preferences (list), narrative_style (string), "
-                                              "decade_preference (string), and viewing_context (string). "
-                                              "Use proper TMDB genre IDs: Action (28), Adventure (12), Animation (16), "
-                                              "Comedy (35), Crime (80), Documentary (99), Drama (18), Family (10751), "
-                                              "Fantasy (14), History (36), Horror (27), Music (10402), Mystery (9648), "
-                                              "Romance (10749), Science Fiction (878), TV Movie (10770), Thriller (53), "
-                                              "War (10752), Western (37)."},
-                {"role": "user", "content": f"Here are my answers to the movie preference quiz:\n{answers_text}"}
-            ]
-        )
-
-        # Extract and parse the JSON profile
-        try:
-            profile_text = response.choices[0].message.content
-            # Extract JSON portion if it's embedded in other text
-            if '{' in profile_text and '}' in profile_text:
-                start = profile_text.find('{')
-                end = profile_text.rfind('}') + 1
-                profile_text = profile_text[start:end]
+                # Create a human-readable summary of the profile
+                context.quiz_results = self._create_profile_summary(context)
 
-            self.user_profile = json.loads(profile_text)
+        self._record_profile_timing(start)
 
-            # Create a human-readable summary of the profile
-            self.quiz_results = self._create_profile_summary()
+    def analyze_quiz_results_stream(self, answers, context=None):
+        """Analyze quiz answers like _analyze_quiz_results, yielding the profile summary as it is written"""
+        context = self._session(context)
+        start = time.perf_counter()
+        context.genre_ids = None
+        context.fallback_profile = False
+
+        with self.metrics.span("quiz", mode=self.profile_mode):
+            # The single-call summary is part of a JSON response, so it arrives in one piece
+            if self.single_call_profile:
+                self._build_profile_and_summary(answers, context)
+                yield context.quiz_results
+            else:
+                self._build_user_profile(answers, context)
+
+                messages = self._profile_summary_messages(context)
+                context.quiz_results = yield from self._stream_completion(
+                    messages, "profile_summary", self._llm_cache_key(messages, context.user_profile))
+
+        self._record_profile_timing(start)
+        return context.quiz_results
+
+    def load_profile(self, user_id=None, answers=None, context=None):
+        """Restore a saved profile for user_id (or identical quiz answers) into the session.
+
+        Returns True if one was found, in which case the quiz doesn't need to be analyzed.
+        """
+        context = self._session(context)
+        if self.profile_store is None or not (user_id or answers):
+            return False
+        try:
+            stored = self.profile_store.load(user_id, answers)
+        except sqlite3.Error as e:
+            print(f"Error loading profile: {e}")
+            return False
+        if stored is None:
+            return False
+
+        context.user_profile = stored.user_profile
+        context.quiz_results = stored.quiz_results
+        context.genre_ids = stored.genre_ids
+        context.fallback_profile = False
+        return True
+
+    def save_profile(self, user_id=None, answers=None, context=None):
+        """Save the session's profile under user_id and/or the quiz answers, with its genre IDs.
+
+        The default profile used when the AI's couldn't be read isn't saved, so the quiz is
+        analyzed again next time instead of the user being stuck with it.
+        """
+        context = self._session(context)
+        if self.profile_store is None or not context.user_profile or context.fallback_profile:
+            return
+        try:
+            self.profile_store.save(StoredProfile(context.user_profile, context.quiz_results,
+                                                  self.get_tmdb_genre_ids(context)), user_id, answers)
+        except sqlite3.Error as e:
+            print(f"Error saving profile: {e}")
+
+    @property
+    def profile_mode(self):
+        """Which quiz profiling path is in use, "single_call" or "two_call" (used as the quiz span's mode label)"""
+        return "single_call" if self.single_call_profile else "two_call"
+
+    def _record_profile_timing(self, start):
+        """Remember how long a quiz analysis took, per profiling mode"""
+        self.profile_timings[self.profile_mode].append(time.perf_counter() - start)
+
+    def _build_profile_and_summary(self, answers, context):
+        """Use one AI request to build both the structured user profile and its friendly summary"""
+        messages = self._profile_and_summary_messages(answers)
+        content = self._complete(messages, "quiz_profile_summary", self._llm_cache_key(messages, answers),
+                                 validate=lambda text: self._parse_profile_and_summary(text) is not None,
+                                 response_format={"type": "json_object"})
+
+        parsed = self._parse_profile_and_summary(content)
+        if parsed is None:
+            print("Error parsing AI response. Requesting the profile and summary separately.")
+            self._build_user_profile(answers, context)
+            context.quiz_results = self._create_profile_summary(context)
+            return
+
+        context.user_profile, context.quiz_results = parsed
+
+    def _profile_and_summary_messages(self, answers):
+        """Quiz profile messages that also ask for the friendly summary, as one JSON object"""
+        messages = self._quiz_profile_messages(answers)
+        messages[0] = {
+            "role": "system",
+            "content": messages[0]["content"] + " Return a JSON object with two keys: \"profile\" holding that "
+                                                "profile object, and \"summary\" holding a friendly, conversational "
+                                                "summary of it in 3-4 sentences, written as if you're talking to "
+                                                "the person directly."
+        }
+        return messages
+
+    @staticmethod
+    def _parse_profile_and_summary(content):
+        """Return (profile, summary) from a single-call profile response, or None if it's malformed"""
+        try:
+            data = json.loads(content)
+            profile, summary = data["profile"], data["summary"]
+        except (json.JSONDecodeError, KeyError, TypeError):
+            return None
+        if not isinstance(profile, dict) or not isinstance(summary, str):
+            return None
+        return profile, summary
+
+    def _build_user_profile(self, answers, context):
+        """Use AI to turn quiz answers into the structured user profile"""
+        messages = self._quiz_profile_messages(answers)
+        profile_text = self._complete(messages, "quiz_profile", self._llm_cache_key(messages, answers),
+                                      validate=lambda text: self._load_profile_json(text) is not None)
+        context.user_profile = self._parse_user_profile(profile_text, context)
+
+    @staticmethod
+    def _load_profile_json(profile_text):
+        """The JSON profile in the AI's response, or None if there isn't a valid one"""
+        # Extract JSON portion if it's embedded in other text
+        if '{' in profile_text and '}' in profile_text:
+            start = profile_text.find('{')
+            end = profile_text.rfind('}') + 1
+            profile_text = profile_text[start:end]
+        try:
+            profile = json.loads(profile_text)
         except json.JSONDecodeError:
-            print("Error parsing AI response. Using simplified profile.")
-            # Fallback to a simpler format if JSON parsing fails
-            self.user_profile = {
+            return None
+        return profile if isinstance(profile, dict) else None
+
+    @staticmethod
+    def _parse_user_profile(profile_text, context):
+        """Parse the AI's JSON profile, falling back to a simple default profile (flagged on the session)"""
+        profile = MoodMovieRecommender._load_profile_json(profile_text or "")
+        context.fallback_profile = profile is None
+        if profile is not None:
+            return profile
+
+        print("Error parsing AI response. Using simplified profile.")
+        # Fallback to a simpler format if JSON parsing fails
+        return {
                 "preferred_genres": [{"id": 18, "name": "Drama"}, {"id": 35, "name": "Comedy"}],
                 "disliked_genres": [],
                 "tone_preferences": ["uplifting"],
@@ -93,41 +413,153 @@ class MoodMovieRecommender:
                 "decade_preference": "modern",
                 "viewing_context": "social"
             }
-            self.quiz_results = self._create_profile_summary()
 
-    def _create_profile_summary(self):
+    def _quiz_profile_messages(self, answers):
+        """Chat messages asking the AI to turn quiz answers into a JSON taste profile"""
+        answers_text = "\n".join([f"Q: {k}: {v}" for k, v in answers.items()])
+
+        return [
+            {"role": "system", "content": "You are a film expert who can analyze a person's movie preferences. "
+                                          "Create a detailed profile of their film taste based on their quiz answers. "
+                                          "Include their preferred genres, themes, and film qualities. "
+                                          "Structure your response as a JSON object with these keys: "
+                                          "preferred_genres (list of TMDB genre IDs and names), "
+                                          "disliked_genres (list of TMDB genre IDs and names), "
+                                          "tone_preferences (list), narrative_style (string), "
+                                          "decade_preference (string), and viewing_context (string). "
+                                          "Use proper TMDB genre IDs: Action (28), Adventure (12), Animation (16), "
+                                          "Comedy (35), Crime (80), Documentary (99), Drama (18), Family (10751), "
+                                          "Fantasy (14), History (36), Horror (27), Music (10402), Mystery (9648), "
+                                          "Romance (10749), Science Fiction (878), TV Movie (10770), Thriller (53), "
+                                          "War (10752), Western (37)."},
+            {"role": "user", "content": f"Here are my answers to the movie preference quiz:\n{answers_text}"}
+        ]
+
+    def _create_profile_summary(self, context=None):
         """Create a human-readable summary of the user profile"""
+        context = self._session(context)
+        messages = self._profile_summary_messages(context)
+        return self._complete(messages, "profile_summary", self._llm_cache_key(messages, context.user_profile))
+
+    def _profile_summary_messages(self, context):
+        """Chat messages asking for a friendly summary of the user profile"""
         profile_prompt = f"""
         Create a friendly, conversational summary of this movie taste profile:
-        {json.dumps(self.user_profile)}
+        {json.dumps(context.user_profile)}
 
         Make it personal and engaging, as if you're talking to the person directly.
         Keep it to 3-4 sentences maximum.
         """
 
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system",
-                 "content": "You are a friendly film enthusiast who can summarize people's movie preferences in an engaging way."},
-                {"role": "user", "content": profile_prompt}
-            ]
-        )
+        return [
+            {"role": "system",
+             "content": "You are a friendly film enthusiast who can summarize people's movie preferences in an engaging way."},
+            {"role": "user", "content": profile_prompt}
+        ]
+
+    def _llm_cache_key(self, messages, *parts):
+        """Hash of the model, system prompt and the normalized inputs that shape a completion"""
+        return ResponseCache.digest([self.model, messages[0]["content"], *parts])
 
-        return response.choices[0].message.content
+    def _complete(self, messages, cache_namespace=None, cache_key=None, until=None, validate=None, **options):
+        """Run a chat completion and return its text, reusing a cached completion when allowed.
 
-    def get_current_mood(self):
+        With until (a time.monotonic() deadline) the request gets a single attempt that
+        times out then, raising openai.APITimeoutError. With validate, a completion is
+        only cached if validate(text) is true, so a response that can't be parsed is
+        asked for again next time.
+        """
+        client = self._deadline_client(until)
+
+        def create():
+            with self.metrics.span("openai.chat", stage=cache_namespace or "chat"):
+                response = client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    **options
+                )
+            self.metrics.record_usage(self.model, response.usage)
+            return response.choices[0].message.content
+
+        if cache_namespace is None or not self.use_llm_cache:
+            return create()
+        return self.llm_cache.get_or_set(cache_namespace, cache_key, create, validate=validate)
+
+    def _deadline_client(self, until):
+        """The OpenAI client, or with until a copy that makes one attempt timing out at until"""
+        if until is None:
+            return self.client
+        return self.client.with_options(timeout=max(0.01, Deadline.left(until)), max_retries=0)
+
+    def _stream_completion(self, messages, cache_namespace=None, cache_key=None, until=None):
+        """Yield chat completion text as it arrives, then return the full text.
+
+        A cached completion is yielded in one piece; a fresh one is cached once the stream completes.
+        With until (a time.monotonic() deadline), the stream is cut off at that time and
+        the text so far is returned (and not cached).
+        """
+        use_cache = cache_namespace is not None and self.use_llm_cache
+        if use_cache:
+            found, text = self.llm_cache.get(cache_namespace, cache_key)
+            if found:
+                yield text
+                return text
+
+        # The span covers the whole stream, including the time the consumer takes per chunk
+        with self.metrics.span("openai.chat", stage=cache_namespace or "chat", stream=True):
+            stream = self._deadline_client(until).chat.completions.create(
+                model=self.model,
+                messages=messages,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+
+            parts = []
+            complete = True
+            try:
+                for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        parts.append(chunk.choices[0].delta.content)
+                        yield parts[-1]
+                    # Usage arrives on the final chunk
+                    if getattr(chunk, "usage", None):
+                        self.metrics.record_usage(self.model, chunk.usage)
+                    if until is not None and time.monotonic() >= until:
+                        complete = False
+                        stream.close()
+                        break
+            except openai.APIConnectionError:
+                # Past its deadline, a stream that has started keeps what has arrived
+                if until is None or not parts:
+                    raise
+                complete = False
+
+        text = "".join(parts)
+        if use_cache and complete:
+            self.llm_cache.set(cache_namespace, cache_key, text)
+        return text
+
+    def get_current_mood(self, context=None):
         """Ask the user about their current mood"""
+        context = self._session(context)
         print("\n--- HOW ARE YOU FEELING TODAY? ---")
         print("Examples: happy, sad, stressed, relaxed, bored, energetic, thoughtful, nostalgic...")
-        self.current_mood = input("Your current mood: ").strip().lower()
-        return self.current_mood
-
-    def get_tmdb_genre_ids(self):
-        """Get genre IDs from the user profile"""
+        context.current_mood = input("Your current mood: ").strip().lower()
+        return context.current_mood
+
+    def get_tmdb_genre_ids(self, context=None):
+        """Get genre IDs from the user profile (parsed once per profile)"""
+        context = self._session(context)
+        if context.genre_ids is None:
+            context.genre_ids = self.profile_genre_ids(context.user_profile)
+        return context.genre_ids
+
+    @staticmethod
+    def profile_genre_ids(user_profile):
+        """Parse the TMDB genre IDs out of a profile's preferred genres"""
         genre_ids = []
         try:
-            for genre in self.user_profile["preferred_genres"]:
+            for genre in user_profile["preferred_genres"]:
                 if isinstance(genre, dict) and "id" in genre:
                     genre_ids.append(genre["id"])
                 elif isinstance(genre, str):
@@ -147,10 +579,16 @@ class MoodMovieRecommender:
 
         return genre_ids
 
-    def search_tmdb_movies(self, mood, page=1):
-        """Search for movies using TMDB API based on genre preferences"""
-        genre_ids = self.get_tmdb_genre_ids()
-        genre_param = ",".join(map(str, genre_ids[:3]))  # Use up to 3 genres
+    def _discover_params(self, context, page=1):
+        """Discover query for the user's genres, current mood and decade preference"""
+        return self.discover_params(self.get_tmdb_genre_ids(context), context.current_mood,
+                                    context.user_profile.get("decade_preference") or "", page)
+
+    @staticmethod
+    def discover_params(genre_ids, mood, decade_preference="", page=1):
+        """Discover query for a list of genre IDs, a mood and a decade preference"""
+        # Use up to 3 genres, sorted so the same genres always give the same (cacheable) query
+        genre_param = ",".join(map(str, sorted(genre_ids[:3])))
 
         # Map mood to sort options
         mood_to_sort = {
@@ -164,126 +602,454 @@ class MoodMovieRecommender:
         }
 
         # Default sort by popularity
-        sort_by = mood_to_sort.get(self.current_mood.lower(), "popularity.desc")
+        sort_by = mood_to_sort.get(mood.lower(), "popularity.desc")
 
         # Determine release year range based on decade_preference
-        year_filter = ""
-        if "decade_preference" in self.user_profile:
-            if "modern" in self.user_profile["decade_preference"].lower():
-                year_filter = "&primary_release_date.gte=2010-01-01"
-            elif "classic" in self.user_profile["decade_preference"].lower():
-                year_filter = "&primary_release_date.lte=1989-12-31"
-            elif "90s" in self.user_profile["decade_preference"].lower():
-                year_filter = "&primary_release_date.gte=1990-01-01&primary_release_date.lte=1999-12-31"
-            # Add more decade filters as needed
-
-        # Construct the API endpoint
-        endpoint = f"{self.tmdb_base_url}/discover/movie"
-        params = f"?api_key={self.tmdb_api_key}&with_genres={genre_param}&sort_by={sort_by}&page={page}&vote_count.gte=100{year_filter}"
+        year_filter = {}
+        decade_preference = str(decade_preference).lower()
+        if "modern" in decade_preference:
+            year_filter = {"primary_release_date.gte": "2010-01-01"}
+        elif "classic" in decade_preference:
+            year_filter = {"primary_release_date.lte": "1989-12-31"}
+        elif "90s" in decade_preference:
+            year_filter = {"primary_release_date.gte": "1990-01-01", "primary_release_date.lte": "1999-12-31"}
+        # Add more decade filters as needed
 
-        try:
-            response = requests.get(endpoint + params)
-            response.raise_for_status()  # Raise exception for HTTP errors
-            return response.json()
-        except requests.exceptions.RequestException as e:
-            print(f"Error connecting to TMDB API: {e}")
-            return {"results": []}
+        return {
+            "with_genres": genre_param,
+            "sort_by": sort_by,
+            "page": page,
+            "vote_count.gte": 100,
+            **year_filter
+        }
+
+    @staticmethod
+    def needs_page_two(results):
+        """Whether page 1 of a discover query is too short on its own, so page 2 joins the candidates"""
+        return len(results) < 5
+
+    @staticmethod
+    def candidate_results(results, more_results=()):
+        """The discover results to hydrate: page 1, then page 2 when it was needed, up to 10 movies"""
+        return (list(results) + list(more_results))[:10]
+
+    def search_tmdb_movies(self, mood, page=1, context=None):
+        """Search for movies using TMDB API based on genre preferences"""
+        return self.discover_movies(self._discover_params(self._session(context), page))
+
+    def discover_movies(self, params, refresh=False):
+        """Run a discover query, answered from the local index, the cache or TMDB"""
+        with self.metrics.span("discover"):
+            # Answer from the local index when it fills the page, skipping the network round-trip.
+            # The index is a capped crawl, so a short page may be missing movies TMDB would return
+            index = self.candidate_index.get()
+            if index is not None:
+                movies_data = index.discover(params)
+                if len(movies_data["results"]) == PAGE_SIZE:
+                    self.metrics.count("index_hits_total")
+                    return movies_data
+
+            try:
+                return self.cache.get_or_set("discover", params,
+                                             lambda: self.tmdb.get("/discover/movie", params), refresh=refresh)
+            except requests.exceptions.RequestException as e:
+                print(f"Error connecting to TMDB API: {e}")
+                return {"results": []}
 
     def get_movie_details(self, movie_id):
         """Get detailed information about a specific movie"""
-        endpoint = f"{self.tmdb_base_url}/movie/{movie_id}"
-        params = f"?api_key={self.tmdb_api_key}&append_to_response=credits"
-
         try:
-            response = requests.get(endpoint + params)
-            response.raise_for_status()
-            return response.json()
+            return self.cache.get_or_set("details", movie_id,
+                                         lambda: self.tmdb.get(f"/movie/{movie_id}",
+                                                               {"append_to_response": "credits"}))
         except requests.exceptions.RequestException as e:
             print(f"Error getting movie details: {e}")
             return {}
 
-    def get_movie_providers(self, movie_id):
+    def get_movie_providers(self, movie_id, region=None):
         """Get streaming providers for a specific movie"""
-        endpoint = f"{self.tmdb_base_url}/movie/{movie_id}/watch/providers"
-        params = f"?api_key={self.tmdb_api_key}"
-
+        region = region or self.region
         try:
-            response = requests.get(endpoint + params)
-            response.raise_for_status()
-            data = response.json()
-            # Return US providers if available, otherwise empty dict
-            if "results" in data and "US" in data["results"]:
-                return data["results"]["US"]
+            data = self.cache.get_or_set("providers", movie_id,
+                                         lambda: self.tmdb.get(f"/movie/{movie_id}/watch/providers"))
+            # Return the region's providers if available, otherwise empty dict
+            if "results" in data and region in data["results"]:
+                return data["results"][region]
             return {}
         except requests.exceptions.RequestException as e:
             print(f"Error getting movie providers: {e}")
             return {}
 
-    def recommend_movies(self):
-        """Generate movie recommendations based on user profile and current mood"""
-        if not self.user_profile or not self.current_mood:
-            return "Please complete the personality quiz and share your mood first."
+    def recommend_movies(self, context=None, deadline=None):
+        """Generate movie recommendations based on user profile and current mood.
+
+        deadline (a Deadline, by default one of the configured budget) bounds how long
+        each stage may take; stages that run out of time leave notes on the result.
+        """
+        context = self._session(context)
+        context.deadline = deadline if deadline is not None else self.start_deadline()
+        with self.metrics.span("recommend"):
+            detailed_movies, message = self._prepare_candidates(context)
+
+            # Use AI to select the best matches for the current mood
+            if detailed_movies:
+                context.last_recommendation = self._analyze_movies_for_mood(detailed_movies, context)
+            else:
+                context.last_recommendation = RecommendationResult(message)
+        return self._with_notes(context)
+
+    def recommend_movies_stream(self, context=None, deadline=None):
+        """Generate recommendations like recommend_movies, yielding the text as it is written.
+
+        When the stream is exhausted, recommended_movie_ids and last_recommendation are set
+        (and the RecommendationResult is the generator's return value).
+        """
+        context = self._session(context)
+        context.deadline = deadline if deadline is not None else self.start_deadline()
+        with self.metrics.span("recommend"):
+            detailed_movies, message = self._prepare_candidates(context)
+
+            if not detailed_movies:
+                context.last_recommendation = RecommendationResult(message)
+                yield message
+                return self._with_notes(context)
+
+            # Structured responses are rendered locally, so they arrive in one piece
+            if self.structured_output:
+                context.last_recommendation = self._analyze_movies_for_mood(detailed_movies, context)
+                yield context.last_recommendation.text
+                return self._with_notes(context)
+
+            # Store detailed_movies on the session so it's available in get_streaming_availability
+            context.detailed_movies = detailed_movies
+
+            until = context.deadline.until("select") if context.deadline is not None else None
+            with self.metrics.span("select"):
+                messages, prompt_movies = self._recommendation_messages(detailed_movies, context)
+                if not prompt_movies:
+                    context.last_recommendation = self._fallback_ranking(detailed_movies, context, over_budget=True)
+                    yield context.last_recommendation.text
+                    return self._with_notes(context)
+                try:
+                    recommendations = yield from self._stream_completion(
+                        messages, "recommendation", self._recommendation_cache_key(messages, prompt_movies, context),
+                        until)
+                except openai.APIConnectionError:
+                    # Includes timeouts; without a deadline there's nothing to fall back to
+                    if until is None:
+                        raise
+                    context.last_recommendation = self._fallback_ranking(detailed_movies, context)
+                    yield context.last_recommendation.text
+                    return self._with_notes(context)
+
+                if until is not None and time.monotonic() >= until:
+                    self._miss(context, "select", "The AI's answer was cut short to stay within the time limit.")
+                context.last_recommendation = self._match_recommended_movies(recommendations, prompt_movies, context)
+        return self._with_notes(context)
+
+    @staticmethod
+    def _with_notes(context):
+        """The session's last recommendation, also carrying the notes of stages that ran out of time"""
+        if context.deadline is not None:
+            notes = context.last_recommendation.notes
+            notes.extend(note for note in context.deadline.notes if note not in notes)
+        return context.last_recommendation
+
+    def _prepare_candidates(self, context):
+        """Find and hydrate candidate movies, returning (detailed_movies, message if there are none)"""
+        if not context.user_profile or not context.current_mood:
+            return [], "Please complete the personality quiz and share your mood first."
+
+        with self.metrics.span("candidates"):
+            candidate_details = self._find_candidates(context)
+
+        if not candidate_details:
+            if context.deadline is not None and "candidates" in context.deadline.missed:
+                return [], "TMDB is responding slowly right now. Please try again in a moment."
+            return [], "No movies found that match your preferences. Please try a different mood."
+
+        detailed_movies = [movie for movie in candidate_details if movie is not None]
+        if not detailed_movies:
+            return [], "Couldn't retrieve detailed movie information. Please try again later."
+        return detailed_movies, None
+
+    def _find_candidates(self, context):
+        """Hydrated candidates (MovieInfo, or None where TMDB failed) for the session"""
+        until = context.deadline.until("candidates") if context.deadline is not None else None
+        ranker = self.embedding_ranker.get()
+        if ranker is not None:
+            # Pre-rank a wide pool by similarity and hydrate only the best matches
+            movie_ids = self._prerank_candidates(ranker, context, until)
+            return self._note_late(context, until, self._hydrate_movies(movie_ids, until))
 
         # Get mood-based movie recommendations from TMDB
-        movies_data = self.search_tmdb_movies(self.current_mood)
-
-        # If we didn't get enough results, try another page
-        if len(movies_data.get("results", [])) < 5:
-            more_movies = self.search_tmdb_movies(self.current_mood, page=2)
-            movies_data["results"] = movies_data.get("results", []) + more_movies.get("results", [])
-
-        # Get up to 10 movies to analyze
-        movie_candidates = movies_data.get("results", [])[:10]
-
-        if not movie_candidates:
-            return "No movies found that match your preferences. Please try a different mood."
-
-        # Get detailed information for each movie
-        detailed_movies = []
-        for movie in movie_candidates:
-            details = self.get_movie_details(movie["id"])
-            if details:
-                # Extract director
-                director = "Unknown"
-                if "credits" in details and "crew" in details["credits"]:
-                    for crew_member in details["credits"]["crew"]:
-                        if crew_member["job"] == "Director":
-                            director = crew_member["name"]
-                            break
-
-                detailed_movies.append({
-                    "id": details["id"],
-                    "title": details["title"],
-                    "year": details["release_date"][:4] if "release_date" in details else "Unknown",
-                    "director": director,
-                    "overview": details["overview"],
-                    "genres": [genre["name"] for genre in details.get("genres", [])],
-                    "vote_average": details.get("vote_average", 0),
-                    "popularity": details.get("popularity", 0)
-                })
-
-        # Use AI to select the best matches for the current mood
-        if detailed_movies:
-            return self._analyze_movies_for_mood(detailed_movies)
+        if until is None:
+            movies_data = self.search_tmdb_movies(context.current_mood, context=context)
+        else:
+            movies_data = self._results_until(
+                [self._submit(self.search_tmdb_movies, context.current_mood, context=context)], until)[0]
+            if movies_data is None:
+                self._miss(context, "candidates", "TMDB search timed out.")
+                return []
+
+        # Get detailed information for up to 10 candidate movies
+        return self._fetch_candidate_details(movies_data.get("results", []), context, until)
+
+    def _note_late(self, context, until, movies):
+        """Pass candidates through, noting on the deadline when some were still loading at until"""
+        if until is not None and None in movies and time.monotonic() >= until:
+            loaded = sum(movie is not None for movie in movies)
+            self._miss(context, "candidates", f"Only {loaded} of {len(movies)} candidate movies loaded in time.")
+        return movies
+
+    def _prerank_candidates(self, ranker, context, until=None):
+        """Pick the top-K movie IDs from a wide candidate pool by embedding similarity to the profile and mood.
+
+        With until (a time.monotonic() deadline), the query embedding gets half of the time
+        left, keeping the rest for hydrating the picks; if it isn't ready by then the top
+        of the pool is used in discover order.
+        """
+        pool_ids = self._candidate_pool(self.prerank_pool_size, context, until)
+        if not pool_ids:
+            return []
+        embed_until = time.monotonic() + Deadline.left(until) / 2 if until is not None else None
+        query_vector = self._embed_query(context, embed_until)
+        if query_vector is None:
+            if embed_until is not None and time.monotonic() >= embed_until:
+                self._miss(context, "candidates",
+                           "Similarity ranking took too long, so candidates are in TMDB's order.")
+            return pool_ids[:self.prerank_top_k]
+        return ranker.rank(pool_ids, query_vector, self.prerank_top_k)
+
+    def _candidate_pool(self, size, context, until=None):
+        """Up to size discover candidate IDs, from the local index or from several discover pages.
+
+        With until (a time.monotonic() deadline), pages not fetched by then are left out.
+        """
+        index = self.candidate_index.get()
+        if index is not None:
+            pool_ids = index.discover_ids(self._discover_params(context), size)
+            if len(pool_ids) >= min(size, PAGE_SIZE):
+                return pool_ids
+
+        # Without an index, fetch up to 5 discover pages (100 candidates) in parallel
+        pages = range(1, min(5, -(-size // 20)) + 1)
+        if until is None:
+            pages_data = self._map_concurrently(
+                lambda page: self.search_tmdb_movies(context.current_mood, page=page, context=context), pages)
         else:
-            return "Couldn't retrieve detailed movie information. Please try again later."
+            pages_data = self._results_until([self._submit(self.search_tmdb_movies, context.current_mood,
+                                                           page=page, context=context) for page in pages], until)
+            if None in pages_data:
+                timed_out = all(data is None for data in pages_data)
+                self._miss(context, "candidates", "TMDB search timed out." if timed_out
+                           else "Only part of the candidate pool loaded in time.")
+        pool_ids = dict.fromkeys(movie["id"] for data in pages_data if data is not None
+                                 for movie in data.get("results", []))
+        return list(pool_ids)[:size]
+
+    def _embed_query(self, context, until=None):
+        """Embedding of the user's profile and current mood, or None if it can't be computed (by until)"""
+        text = self._embedding_query_text(context)
+
+        def create():
+            with self.metrics.span("openai.embedding"):
+                response = self._deadline_client(until).embeddings.create(model=EMBEDDING_MODEL, input=text)
+            self.metrics.record_usage(EMBEDDING_MODEL, response.usage)
+            return response.data[0].embedding
 
-    def _analyze_movies_for_mood(self, detailed_movies):
-        """Use AI to select and explain the best movies for the current mood"""
-        # Store detailed_movies as an instance attribute so it's available in get_streaming_availability
-        self.detailed_movies = detailed_movies
+        try:
+            if not self.use_llm_cache:
+                return create()
+            return self.llm_cache.get_or_set("embedding", ResponseCache.digest([EMBEDDING_MODEL, text]), create)
+        except openai.OpenAIError as e:
+            print(f"Error creating query embedding: {e}")
+            return None
+
+    @staticmethod
+    def _embedding_query_text(context):
+        """Text embedded for a session: its profile and normalized mood"""
+        return (f"Movie taste profile: {json.dumps(context.user_profile, sort_keys=True)}\n"
+                f"Current mood: {context.current_mood.strip().lower()}")
+
+    def hydrate_movie(self, movie_id, refresh=False):
+        """Fetch details, credits and watch providers for a movie in one request.
+
+        Returns a MovieInfo holding only the fields we use, or None if TMDB can't be reached.
+        """
+        try:
+            data = self.cache.get_or_set("movie", movie_id, lambda: self._compact_movie(
+                self.tmdb.get(f"/movie/{movie_id}", {"append_to_response": "credits,watch/providers"})
+            ), refresh=refresh)
+            return MovieInfo(**data)
+        except requests.exceptions.RequestException as e:
+            print(f"Error getting movie details: {e}")
+            return None
+
+    def _fetch_candidate_details(self, results, context, until=None):
+        """Hydrate up to 10 candidates, in discover order, one entry per candidate.
+
+        With until (a time.monotonic() deadline), candidates not hydrated by then are None.
+        """
+        with self.metrics.span("hydrate"):
+            if self.max_workers == 1:
+                # If we didn't get enough results, try another page
+                more_movies = []
+                if self.needs_page_two(results):
+                    more_movies = self.search_tmdb_movies(context.current_mood, page=2,
+                                                          context=context).get("results", [])
+
+                # Serially, the deadline is checked between requests
+                return self._note_late(context, until, [
+                    self.hydrate_movie(movie["id"]) if until is None or time.monotonic() < until else None
+                    for movie in self.candidate_results(results, more_movies)])
+
+            # Start the page-2 fallback first so it overlaps with the page-1 detail requests
+            page_two = None
+            if self.needs_page_two(results):
+                page_two = self._submit(self.search_tmdb_movies, context.current_mood, page=2, context=context)
+
+            futures = [self._submit(self.hydrate_movie, movie["id"]) for movie in self.candidate_results(results)]
+
+            if page_two is not None:
+                more_movies = (self._results_until([page_two], until)[0] or {}).get("results", [])
+                futures += [self._submit(self.hydrate_movie, movie["id"])
+                            for movie in self.candidate_results(results, more_movies)[len(futures):]]
+
+            # Collect in submission order so the candidate ranking is unchanged
+            return self._note_late(context, until, self._results_until(futures, until))
+
+    def _hydrate_movies(self, movie_ids, until=None):
+        """Hydrate movies concurrently, one entry (MovieInfo or None) per ID, in order.
+
+        With until (a time.monotonic() deadline), movies not hydrated by then are None.
+        """
+        with self.metrics.span("hydrate"):
+            if until is None:
+                return self._map_concurrently(self.hydrate_movie, movie_ids)
+            return self._results_until([self._submit(self.hydrate_movie, movie_id) for movie_id in movie_ids], until)
 
-        movies_json = json.dumps(detailed_movies)
+    @staticmethod
+    def _results_until(futures, until=None):
+        """Results of futures in order, waiting until the time.monotonic() deadline until at most.
 
-        recommendation_prompt = f"""
-        Based on this user's movie taste profile:
-        {json.dumps(self.user_profile)}
+        Futures still running then are None in the results; they keep running, so their
+        responses still reach the cache for the next request.
+        """
+        if until is None:
+            return [future.result() for future in futures]
+        wait(futures, timeout=Deadline.left(until))
+        return [future.result() if future.done() else None for future in futures]
+
+    def _map_concurrently(self, function, items):
+        """Apply function to every item on the shared TMDB pool, keeping the input order"""
+        items = list(items)
+        if self.max_workers == 1 or len(items) <= 1:
+            return [function(item) for item in items]
+
+        return [future.result() for future in [self._submit(function, item) for item in items]]
+
+    def _submit(self, function, *args, **kwargs):
+        """Run function on the shared TMDB pool with the caller's context (so spans join its trace)"""
+        return self._executor.submit(contextvars.copy_context().run, function, *args, **kwargs)
+
+    @staticmethod
+    def _compact_providers(region_data):
+        """Keep only the provider names for the offer types we show"""
+        return {
+            offer: [provider["provider_name"] for provider in region_data[offer]]
+            for offer in ("flatrate", "rent")
+            if offer in region_data
+        }
 
-        And their current mood: {self.current_mood}
+    def _compact_movie(self, details):
+        """Reduce a hydrated TMDB movie payload to the fields used for recommendations"""
+        # Extract director
+        director = "Unknown"
+        if "credits" in details and "crew" in details["credits"]:
+            for crew_member in details["credits"]["crew"]:
+                if crew_member["job"] == "Director":
+                    director = crew_member["name"]
+                    break
 
-        And this list of candidate movies from TMDB:
-        {movies_json}
+        # Providers by region, e.g. {"US": {"flatrate": ["Netflix"], "rent": ["Apple TV"]}}
+        regions = details.get("watch/providers", {}).get("results", {})
 
+        return {
+            "id": details["id"],
+            "title": details["title"],
+            "year": details["release_date"][:4] if details.get("release_date") else "Unknown",
+            "director": director,
+            "overview": details.get("overview", ""),
+            "genres": [genre["name"] for genre in details.get("genres", [])],
+            "genre_ids": [genre["id"] for genre in details.get("genres", [])],
+            "vote_average": details.get("vote_average", 0),
+            "popularity": details.get("popularity", 0),
+            "poster_path": details.get("poster_path"),
+            "providers": {region: self._compact_providers(data) for region, data in regions.items()}
+        }
+
+    def _analyze_movies_for_mood(self, detailed_movies, context=None):
+        """Use AI to select and explain the best movies for the current mood"""
+        context = self._session(context)
+        # Store detailed_movies on the session so it's available in get_streaming_availability
+        context.detailed_movies = detailed_movies
+
+        until = context.deadline.until("select") if context.deadline is not None else None
+        with self.metrics.span("select"):
+            try:
+                if self.structured_output:
+                    return self._select_movies_structured(detailed_movies, context, until)
+
+                messages, prompt_movies = self._recommendation_messages(detailed_movies, context)
+                if not prompt_movies:
+                    return self._fallback_ranking(detailed_movies, context, over_budget=True)
+                recommendations = self._complete(
+                    messages, "recommendation", self._recommendation_cache_key(messages, prompt_movies, context),
+                    until=until)
+                return self._match_recommended_movies(recommendations, prompt_movies, context)
+            except openai.APIConnectionError:
+                # Includes timeouts; without a deadline there's nothing to fall back to
+                if until is None:
+                    raise
+                return self._fallback_ranking(detailed_movies, context)
+
+    def _fallback_ranking(self, detailed_movies, context, over_budget=False):
+        """The best-rated candidates, for when the AI doesn't answer in time.
+
+        With over_budget, the prompt had no room for any candidate, so the AI wasn't asked.
+        """
+        if not over_budget:
+            self._miss(context, "select", "The AI took too long to answer, so these are the best-rated matches instead.")
+        ranked = sorted(detailed_movies, key=lambda movie: (movie.vote_average or 0, movie.popularity or 0),
+                        reverse=True)[:5]
+        context.recommended_movie_ids = [movie.id for movie in ranked]
+
+        lines = [f"{i}. {movie.title} ({movie.year})\n"
+                 f"   Director: {movie.director}\n"
+                 f"   Rated {movie.vote_average or 0:.1f}/10 on TMDB"
+                 for i, movie in enumerate(ranked, 1)]
+        result = RecommendationResult("\n\n".join(lines), detailed_movies, list(context.recommended_movie_ids))
+        if over_budget:
+            result.notes.append("Your taste profile is too long to show the AI any candidates, "
+                                "so these are the best-rated matches instead.")
+        return result
+
+    def _recommendation_messages(self, detailed_movies, context, structured=False):
+        """Chat messages asking the AI to pick the best candidates for the profile and mood.
+
+        Returns (messages, prompt_movies): the prompt is kept within the token budget, so
+        prompt_movies may be a prefix of detailed_movies.
+        """
+        if structured:
+            instructions = """
+        Select the 5 movies that would best match both their taste profile and current mood.
+        Return them best match first, each with its TMDB "id" from the candidate list and
+        a brief explanation of why it matches both their taste profile and current mood,
+        as a JSON object: {"recommendations": [{"id": 123, "explanation": "..."}]}
+        """
+        else:
+            instructions = """
         Select the 5 movies that would best match both their taste profile and current mood.
         For each movie, include:
         1. Title (Year)
@@ -293,124 +1059,217 @@ class MoodMovieRecommender:
         Format your response as a numbered list.
         """
 
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=[
-                {"role": "system",
-                 "content": "You are an expert film recommender with encyclopedic knowledge of cinema."},
-                {"role": "user", "content": recommendation_prompt}
-            ]
-        )
-
-        recommendations = response.choices[0].message.content
-
+        recommendation_prompt, prompt_movies, prompt_tokens = self.prompt_builder.build(
+            context.user_profile, context.current_mood, detailed_movies, instructions)
+        if detailed_movies and not prompt_movies:
+            # The profile, mood and instructions leave no room for a single candidate
+            print(f"Recommendation prompt is {prompt_tokens} tokens without candidates, leaving no room for any "
+                  f"within PROMPT_TOKEN_BUDGET ({self.prompt_builder.token_budget})")
+        if len(prompt_movies) < len(detailed_movies):
+            self.metrics.count("prompt_candidates_trimmed_total", len(detailed_movies) - len(prompt_movies))
+
+        messages = [
+            {"role": "system",
+             "content": "You are an expert film recommender with encyclopedic knowledge of cinema."},
+            {"role": "user", "content": recommendation_prompt}
+        ]
+        return messages, prompt_movies
+
+    def _select_movies_structured(self, detailed_movies, context, until=None):
+        """Ask the AI for recommended TMDB IDs and explanations as JSON and render the list locally"""
+        messages, prompt_movies = self._recommendation_messages(detailed_movies, context, structured=True)
+        if not prompt_movies:
+            return self._fallback_ranking(detailed_movies, context, over_budget=True)
+        content = self._complete(messages, "recommendation_json",
+                                 self._recommendation_cache_key(messages, prompt_movies, context),
+                                 until=until, validate=lambda text: self._parse_picks(text) is not None,
+                                 response_format=self.recommendation_format)
+        return self._render_structured_picks(content, prompt_movies, context)
+
+    @property
+    def recommendation_format(self):
+        """response_format for structured recommendations: the strict schema, or plain JSON mode"""
+        return RECOMMENDATION_SCHEMA if self.structured_output == "json_schema" else RECOMMENDATION_JSON_OBJECT
+
+    @staticmethod
+    def _parse_picks(content):
+        """The list of picks in a structured recommendation response, or None if it's malformed"""
+        try:
+            picks = json.loads(content)["recommendations"]
+        except (json.JSONDecodeError, KeyError, TypeError):
+            return None
+        return picks if isinstance(picks, list) else None
+
+    def _render_structured_picks(self, content, detailed_movies, context):
+        """Turn a structured recommendation response into the numbered list and its result"""
+        picks = self._parse_picks(content)
+        if picks is None:
+            print("Error parsing AI response. Matching titles instead.")
+            return self._match_recommended_movies(content or "", detailed_movies, context)
+
+        # Keep only IDs from the candidate list, once each, in the order the AI ranked them
+        candidates = {movie.id: movie for movie in detailed_movies}
+        explanations = {}
+        for pick in picks:
+            if isinstance(pick, dict) and pick.get("id") in candidates and pick["id"] not in explanations:
+                explanations[pick["id"]] = pick.get("explanation", "")
+
+        context.recommended_movie_ids = list(explanations)[:5]
+        if not context.recommended_movie_ids:
+            return RecommendationResult("Couldn't match the AI's picks to any candidate movie. Please try again.",
+                                        detailed_movies)
+
+        lines = []
+        for i, movie_id in enumerate(context.recommended_movie_ids, 1):
+            movie = candidates[movie_id]
+            lines.append(f"{i}. {movie.title} ({movie.year})\n"
+                         f"   Director: {movie.director}\n"
+                         f"   {explanations[movie_id]}")
+
+        return RecommendationResult("\n\n".join(lines), detailed_movies, list(context.recommended_movie_ids),
+                                    {movie_id: explanations[movie_id] for movie_id in context.recommended_movie_ids})
+
+    def _recommendation_cache_key(self, messages, detailed_movies, context):
+        """Cache key for a recommendation: profile, lowercased mood and the sorted candidate IDs"""
+        candidate_ids = sorted(movie.id for movie in detailed_movies)
+        return self._llm_cache_key(messages, context.user_profile, context.current_mood.strip().lower(), candidate_ids)
+
+    def _match_recommended_movies(self, recommendations, detailed_movies, context):
+        """Record which candidates the recommendation text mentions and build the result"""
         # Store the recommended movie IDs for streaming lookup
-        self.recommended_movie_ids = []
+        context.recommended_movie_ids = []
         for movie in detailed_movies:
-            if movie["title"] in recommendations:
-                self.recommended_movie_ids.append(movie["id"])
-
-        return recommendations
-
-    def get_streaming_availability(self, recommendations):
-        """Check where the recommended movies are available for streaming using TMDB data"""
-        if not hasattr(self, "recommended_movie_ids") or not self.recommended_movie_ids:
-            # Extract movie titles from recommendations text
-            import re
-            movie_titles = re.findall(r'\d+\.\s+([^(]+)', recommendations)
-
-            streaming_prompt = f"""
-            For these recommended movies:
+            if movie.title in recommendations:
+                context.recommended_movie_ids.append(movie.id)
 
-            {recommendations}
+        return RecommendationResult(recommendations, detailed_movies, list(context.recommended_movie_ids))
 
-            Suggest where each might be available for streaming (Netflix, Hulu, Amazon Prime, Disney+, HBO Max, etc.).
-            If you're not certain, make your best educated guess based on the type of film and its age/popularity.
+    def get_streaming_availability(self, recommendations, context=None, region=None, deadline=None):
+        """Check where the recommended movies are available for streaming using TMDB data.
 
-            Format your response as a simple list showing "Movie Title - Likely available on: [services]" for each movie.
-            """
+        With a deadline (by default one of the configured budget), lookups still running
+        when the providers stage runs out of time are shown as not loaded, and the session's
+        last recommendation gets a note saying so.
+        """
+        context = self._session(context)
+        context.deadline = deadline if deadline is not None else self.start_deadline()
+        with self.metrics.span("providers"):
+            streaming_info = self._lookup_availability(recommendations, context, region)
+        if context.last_recommendation is not None:
+            self._with_notes(context)
+        return streaming_info
+
+    def _lookup_availability(self, recommendations, context, region):
+        """Body of get_streaming_availability, run inside its span"""
+        until = context.deadline.until("providers") if context.deadline is not None else None
+        if not context.recommended_movie_ids:
+            try:
+                return self._complete(self._streaming_guess_messages(recommendations), until=until)
+            except openai.APIConnectionError:
+                if until is None:
+                    raise
+                self._miss(context, "providers", "Streaming availability didn't load in time.")
+                return STREAMING_PENDING
+
+        # If we have movie IDs, look up actual streaming info in one concurrent wave
+        movies = self._hydrate_batch(context.recommended_movie_ids, context.detailed_movies, until)
+        pending = until is not None and len(movies) < len(context.recommended_movie_ids) and \
+            time.monotonic() >= until
+        if pending:
+            self._miss(context, "providers", "Streaming availability didn't load in time for every movie.")
+        return self._availability_text(context.recommended_movie_ids, movies, region or self.region, pending)
+
+    def get_providers_batch(self, movie_ids, region=None, movies=()):
+        """Watch providers for many movies at once: {movie ID: {"flatrate": [names], "rent": [names]}}.
+
+        Movies passed in movies (hydrated MovieInfo) cost no request; the rest are hydrated
+        concurrently. Movies TMDB can't return are left out.
+        """
+        region = region or self.region
+        return {movie_id: movie.providers.get(region, {})
+                for movie_id, movie in self._hydrate_batch(movie_ids, movies).items()}
+
+    def _hydrate_batch(self, movie_ids, movies=(), until=None):
+        """{movie ID: MovieInfo} for movie_ids, hydrating only the ones missing from movies (by until, if given)"""
+        known = {movie.id: movie for movie in movies}
+        missing = [movie_id for movie_id in dict.fromkeys(movie_ids) if movie_id not in known]
+        for movie in self._hydrate_movies(missing, until) if missing else []:
+            if movie is not None:
+                known[movie.id] = movie
+        return {movie_id: known[movie_id] for movie_id in movie_ids if movie_id in known}
+
+    def _availability_text(self, movie_ids, movies, region, pending=False):
+        """The "Where to Watch" list for movie_ids, given their hydrated movies.
+
+        With pending, movies missing from movies weren't looked up in time rather than unavailable.
+        """
+        streaming_info = []
+        for movie_id in movie_ids:
+            movie = movies.get(movie_id)
+            if movie is not None:
+                streaming_info.append(self._availability_line(movie.title, movie.providers.get(region, {})))
+            elif pending:
+                streaming_info.append(f"Movie {movie_id} - Providers didn't load in time")
+            else:
+                streaming_info.append(self._availability_line(f"Movie {movie_id}", {}))
+        return "\n".join(streaming_info)
 
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system",
-                     "content": "You are a helpful assistant with knowledge about movie streaming availability."},
-                    {"role": "user", "content": streaming_prompt}
-                ]
-            )
+    @staticmethod
+    def _streaming_guess_messages(recommendations):
+        """Chat messages asking the AI to guess streaming services when we have no TMDB IDs"""
+        streaming_prompt = f"""
+        For these recommended movies:
 
-            return response.choices[0].message.content
+        {recommendations}
 
-        # If we have movie IDs, look up actual streaming info
-        streaming_info = []
-        for movie_id in self.recommended_movie_ids:
-            providers = self.get_movie_providers(movie_id)
-
-            # Get movie title
-            movie_title = ""
-            # We need to use self.detailed_movies which is stored during recommend_movies
-            if hasattr(self, "detailed_movies"):
-                for movie in self.detailed_movies:
-                    if movie["id"] == movie_id:
-                        movie_title = movie["title"]
-                        break
+        Suggest where each might be available for streaming (Netflix, Hulu, Amazon Prime, Disney+, HBO Max, etc.).
+        If you're not certain, make your best educated guess based on the type of film and its age/popularity.
 
-            # If we still don't have a title, fetch it directly
-            if not movie_title:
-                try:
-                    details = self.get_movie_details(movie_id)
-                    movie_title = details.get("title", f"Movie {movie_id}")
-                except:
-                    movie_title = f"Movie {movie_id}"
-
-            # Extract provider names
-            available_on = []
-
-            # Check flatrate (subscription) providers
-            if "flatrate" in providers:
-                for provider in providers["flatrate"]:
-                    available_on.append(provider["provider_name"])
-
-            # Check rent providers if no subscription options
-            if not available_on and "rent" in providers:
-                for provider in providers["rent"][:3]:  # Limit to 3 rental options
-                    available_on.append(f"{provider['provider_name']} (rent)")
-
-            # Format the provider information
-            if available_on:
-                provider_text = ", ".join(available_on)
-                streaming_info.append(f"{movie_title} - Available on: {provider_text}")
-            else:
-                streaming_info.append(f"{movie_title} - No streaming data available")
+        Format your response as a simple list showing "Movie Title - Likely available on: [services]" for each movie.
+        """
 
-        if streaming_info:
-            return "\n".join(streaming_info)
-        else:
-            # Fallback to AI-generated suggestions
-            return self.get_streaming_availability(recommendations)  # This will use the AI fallback
+        return [
+            {"role": "system",
+             "content": "You are a helpful assistant with knowledge about movie streaming availability."},
+            {"role": "user", "content": streaming_prompt}
+        ]
 
-    def run_full_workflow(self):
+    @staticmethod
+    def _availability_line(movie_title, providers):
+        """One "Where to Watch" line for a movie's compact providers"""
+        # Use subscription providers, or up to 3 rental options if there are none
+        available_on = list(providers.get("flatrate", []))
+        if not available_on:
+            available_on = [f"{name} (rent)" for name in providers.get("rent", [])[:3]]
+
+        # Format the provider information
+        if available_on:
+            provider_text = ", ".join(available_on)
+            return f"{movie_title} - Available on: {provider_text}"
+        return f"{movie_title} - No streaming data available"
+
+    def run_full_workflow(self, context=None):
         """Run the complete movie recommendation workflow"""
+        context = self._session(context)
         print("Welcome to the Mood-Based Movie Recommender!")
         print("Let's start by understanding your movie preferences.")
 
-        # Run personality quiz
-        profile = self.run_personality_quiz()
+        # Run personality quiz, printing the profile summary as it is written
+        answers = self._ask_quiz_questions()
         print("\n--- YOUR MOVIE PERSONALITY ---")
-        print(profile)
+        profile = self._print_stream(self.analyze_quiz_results_stream(answers, context))
 
         # Get current mood
-        mood = self.get_current_mood()
+        mood = self.get_current_mood(context)
         print(f"\nFeeling {mood}? Let's find some movies for you!")
 
         # Generate recommendations
         print("\n--- YOUR PERSONALIZED RECOMMENDATIONS ---")
-        recommendations = self.recommend_movies()
-        print(recommendations)
+        recommendations = self._print_stream(self.recommend_movies_stream(context))
 
         # Get streaming availability
         print("\n--- WHERE TO WATCH ---")
-        streaming_info = self.get_streaming_availability(recommendations)
+        streaming_info = self.get_streaming_availability(recommendations, context)
         print(streaming_info)
 
         return {
@@ -420,6 +1279,16 @@ class MoodMovieRecommender:
             "streaming_info": streaming_info
         }
 
+    @staticmethod
+    def _print_stream(chunks):
+        """Print streamed text as it arrives and return the generator's final value"""
+        try:
+            while True:
+                print(next(chunks), end="", flush=True)
+        except StopIteration as done:
+            print()
+            return done.value
+
 if __name__ == "__main__":
     recommender = MoodMovieRecommender()
     results = recommender.run_full_workflow()
\ No newline at end of file
@@ -0,0 +1,154 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+
+from ResponseCache import ResponseCache
+
+
+@dataclass
+class StoredProfile:
+    """A saved quiz result: the structured profile, its summary and the profile's TMDB genre IDs"""
+    user_profile: dict
+    quiz_results: str
+    genre_ids: list = None  # None if it wasn't precomputed (e.g. imported without it)
+
+
+class ProfileStore:
+    """SQLite store of quiz profiles, keyed by user ID or by a hash of the quiz answers.
+
+    The database is opened on first use and profiles are read one at a time when a
+    user returns, so the store can grow without slowing down startup.
+    """
+
+    def __init__(self, path="cinemood_profiles.sqlite3"):
+        self.path = path
+        # sqlite3 connections can't be shared between threads, so each thread opens its own
+        self._local = threading.local()
+
+    def _connection(self):
+        """Get this thread's connection, opening it (and creating the table) on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                conn.execute("""
+                    CREATE TABLE IF NOT EXISTS profiles (
+                        key TEXT PRIMARY KEY,
+                        user_id TEXT,
+                        answers_hash TEXT,
+                        profile TEXT NOT NULL,
+                        summary TEXT NOT NULL,
+                        genre_ids TEXT,
+                        updated_at REAL NOT NULL
+                    )
+                """)
+                conn.execute("CREATE INDEX IF NOT EXISTS profiles_answers_hash ON profiles (answers_hash)")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def answers_hash(answers):
+        """Hash of quiz answers, ignoring case and surrounding whitespace"""
+        return ResponseCache.digest({key: str(value).strip().lower() for key, value in answers.items()})
+
+    @staticmethod
+    def _key(user_id, answers_hash):
+        return f"user:{user_id}" if user_id else f"answers:{answers_hash}"
+
+    def load(self, user_id=None, answers=None):
+        """The profile saved for user_id, else for identical answers, or None"""
+        conn = self._connection()
+        row = None
+        if user_id:
+            row = conn.execute("SELECT profile, summary, genre_ids FROM profiles WHERE key = ?",
+                               (self._key(user_id, None),)).fetchone()
+        if row is None and answers:
+            row = conn.execute("SELECT profile, summary, genre_ids FROM profiles WHERE answers_hash = ? "
+                               "ORDER BY updated_at DESC LIMIT 1", (self.answers_hash(answers),)).fetchone()
+        if row is None:
+            return None
+        return StoredProfile(json.loads(row[0]), row[1], json.loads(row[2]) if row[2] is not None else None)
+
+    def save(self, profile, user_id=None, answers=None):
+        """Save a StoredProfile under user_id, or under the answers' hash for anonymous users"""
+        answers_hash = self.answers_hash(answers) if answers else None
+        if not user_id and not answers_hash:
+            raise ValueError("A profile needs a user ID or quiz answers to be saved under")
+
+        self._write([(self._key(user_id, answers_hash), user_id or None, answers_hash,
+                      json.dumps(profile.user_profile), profile.quiz_results,
+                      json.dumps(profile.genre_ids) if profile.genre_ids is not None else None, time.time())])
+
+    def delete(self, user_id):
+        """Forget a user's profile"""
+        with self._connection() as conn:
+            conn.execute("DELETE FROM profiles WHERE key = ?", (self._key(user_id, None),))
+
+    def _write(self, rows):
+        with self._connection() as conn:
+            conn.executemany("INSERT OR REPLACE INTO profiles "
+                             "(key, user_id, answers_hash, profile, summary, genre_ids, updated_at) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def export_jsonl(self, path):
+        """Write every profile to a JSON lines file, returning the number written"""
+        count = 0
+        with open(path, "w", encoding="utf-8") as f:
+            for row in self._connection().execute(
+                    "SELECT user_id, answers_hash, profile, summary, genre_ids, updated_at FROM profiles ORDER BY key"):
+                f.write(json.dumps({
+                    "user_id": row[0],
+                    "answers_hash": row[1],
+                    "profile": json.loads(row[2]),
+                    "summary": row[3],
+                    "genre_ids": json.loads(row[4]) if row[4] is not None else None,
+                    "updated_at": row[5]
+                }) + "\n")
+                count += 1
+        return count
+
+    def import_jsonl(self, path):
+        """Add (or replace) the profiles in a JSON lines file from export_jsonl, in one transaction"""
+        rows = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                user_id, answers_hash = record.get("user_id"), record.get("answers_hash")
+                if not user_id and not answers_hash:
+                    continue
+                genre_ids = record.get("genre_ids")
+                rows.append((self._key(user_id, answers_hash), user_id or None, answers_hash,
+                             json.dumps(record["profile"]), record.get("summary", ""),
+                             json.dumps(genre_ids) if genre_ids is not None else None,
+                             record.get("updated_at", time.time())))
+        self._write(rows)
+        return len(rows)
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM profiles").fetchone()[0]
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Bulk export or import saved quiz profiles")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("file", help="JSON lines file to write (export) or read (import)")
+    parser.add_argument("--db", default=os.getenv("PROFILE_STORE_PATH") or "cinemood_profiles.sqlite3")
+    args = parser.parse_args()
+
+    store = ProfileStore(args.db)
+    if args.command == "export":
+        print(f"Exported {store.export_jsonl(args.file)} profiles to {args.file}")
+    else:
+        print(f"Imported {store.import_jsonl(args.file)} profiles into {args.db}")
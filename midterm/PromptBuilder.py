@@ -0,0 +1,120 @@
+import json
+import math
+import textwrap
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # optional: without it token counts are estimated from the text length
+    tiktoken = None
+
+# TMDB movie genre names, used to spell out the genre IDs that appear in a prompt
+GENRE_NAMES = {
+    28: "Action", 12: "Adventure", 16: "Animation", 35: "Comedy", 80: "Crime", 99: "Documentary",
+    18: "Drama", 10751: "Family", 14: "Fantasy", 36: "History", 27: "Horror", 10402: "Music",
+    9648: "Mystery", 10749: "Romance", 878: "Science Fiction", 10770: "TV Movie", 53: "Thriller",
+    10752: "War", 37: "Western"
+}
+
+
+@lru_cache(maxsize=8)
+def _encoding(model):
+    """tiktoken encoding for a model (o200k_base for models tiktoken doesn't know)"""
+    try:
+        return tiktoken.encoding_for_model(model or "")
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text, model=None):
+    """Number of tokens in text: exact with tiktoken installed, otherwise about 4 characters per token"""
+    if tiktoken is not None:
+        return len(_encoding(model).encode(text))
+    return math.ceil(len(text) / 4)
+
+
+def truncate(text, max_chars):
+    """Cut text to at most max_chars at a word boundary, marking the cut with an ellipsis"""
+    if len(text) <= max_chars:
+        return text
+    if max_chars <= 0:
+        return ""
+    cut = text[:max_chars].rsplit(" ", 1)[0]
+    return cut.rstrip(",.;:") + "…"
+
+
+class PromptBuilder:
+    """Builds the candidate-selection prompt within a token budget.
+
+    Candidates are encoded one compact JSON object per line (short keys, genre IDs,
+    truncated overviews). When the prompt doesn't fit, overviews are shortened step by
+    step and then the lowest-ranked candidates are dropped, so the prompt (genre legend
+    included) stays within the budget however many candidates are fetched.
+    """
+
+    def __init__(self, token_budget=2500, overview_chars=240, model=None):
+        self.token_budget = token_budget
+        self.overview_chars = overview_chars
+        self.model = model
+
+    @staticmethod
+    def compact_movie(movie, overview_chars):
+        """Short-key encoding of a MovieInfo"""
+        data = {"id": movie.id, "t": movie.title, "y": movie.year, "d": movie.director,
+                "g": movie.genre_ids, "r": round(movie.vote_average or 0, 1)}
+        overview = truncate(movie.overview or "", overview_chars)
+        if overview:
+            data["o"] = overview
+        return data
+
+    @staticmethod
+    def compact_profile(profile):
+        """The profile as minified JSON, without empty fields"""
+        return json.dumps({key: value for key, value in profile.items() if value not in (None, "", [], {})},
+                          separators=(",", ":"), ensure_ascii=False)
+
+    def build(self, profile, mood, movies, instructions):
+        """Return (prompt text, movies included, token count)"""
+        head = (f"User taste profile: {self.compact_profile(profile)}\n"
+                f"Current mood: {mood}\n"
+                "Candidate movies from TMDB, one JSON object per line "
+                "(t=title, y=year, d=director, g=TMDB genre IDs, r=rating out of 10, o=overview):\n")
+        tail = f"\n{textwrap.dedent(instructions).strip()}"
+        fixed_tokens = count_tokens(head + tail, self.model)
+
+        # Shorten overviews first, then drop candidates from the bottom of the ranking
+        for overview_chars in (self.overview_chars, self.overview_chars // 2, 0):
+            lines = [json.dumps(self.compact_movie(movie, overview_chars), separators=(",", ":"), ensure_ascii=False)
+                     for movie in movies]
+            costs = [count_tokens(line + "\n", self.model) for line in lines]
+            if fixed_tokens + self._legend_tokens(movies) + sum(costs) <= self.token_budget:
+                break
+
+        # Each candidate also adds its genres to the legend, so count the legend as it grows
+        included = 0
+        total = fixed_tokens
+        for cost in costs:
+            if total + cost + self._legend_tokens(movies[:included + 1]) > self.token_budget:
+                break
+            total += cost
+            included += 1
+
+        # Tokens can merge across the joined pieces, so measure the real prompt and drop
+        # candidates until it fits
+        while True:
+            prompt = (head + "".join(line + "\n" for line in lines[:included])
+                      + self._genre_legend(movies[:included]) + tail)
+            tokens = count_tokens(prompt, self.model)
+            if tokens <= self.token_budget or included == 0:
+                return prompt, movies[:included], tokens
+            included -= 1
+
+    def _genre_legend(self, movies):
+        """Names for the genre IDs used by movies, e.g. "Genres: 18=Drama, 35=Comedy\""""
+        genre_ids = sorted({genre_id for movie in movies for genre_id in movie.genre_ids if genre_id in GENRE_NAMES})
+        if not genre_ids:
+            return ""
+        return "Genres: " + ", ".join(f"{genre_id}={GENRE_NAMES[genre_id]}" for genre_id in genre_ids) + "\n"
+
+    def _legend_tokens(self, movies):
+        return count_tokens(self._genre_legend(movies), self.model)
@@ -0,0 +1,43 @@
+import asyncio
+import threading
+import time
+
+
+class RateLimiter:
+    """Token bucket shared by threads and asyncio tasks.
+
+    Allows on average rate acquisitions per second, in bursts of up to burst. Each
+    caller reserves a token under the lock and then waits outside it, so waiting callers
+    are served in arrival order without holding the lock, and the sync and async TMDB
+    clients can draw from the same bucket.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = burst if burst is not None else max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        """Take a token, returning how many seconds the caller has to wait before using it"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def acquire(self):
+        """Block until a token is available, returning the seconds waited"""
+        delay = self._reserve()
+        if delay:
+            time.sleep(delay)
+        return delay
+
+    async def acquire_async(self):
+        """Wait (without blocking the event loop) until a token is available, returning the seconds waited"""
+        delay = self._reserve()
+        if delay:
+            await asyncio.sleep(delay)
+        return delay
@@ -0,0 +1,45 @@
+from dataclasses import dataclass, field
+
+TMDB_POSTER_BASE_URL = "https://image.tmdb.org/t/p/w500"
+
+
+@dataclass
+class MovieInfo:
+    """The detail fields of a candidate movie that the recommender and the UI use"""
+    id: int
+    title: str
+    year: str
+    director: str
+    overview: str
+    genres: list
+    genre_ids: list = field(default_factory=list)  # TMDB genre IDs, same order as genres
+    vote_average: float = 0
+    popularity: float = 0
+    poster_path: str = None
+    providers: dict = field(default_factory=dict)  # region -> {"flatrate": [names], "rent": [names]}
+
+    @property
+    def poster_url(self):
+        """Full poster image URL, or None if TMDB has no poster"""
+        if self.poster_path:
+            return f"{TMDB_POSTER_BASE_URL}{self.poster_path}"
+        return None
+
+
+@dataclass
+class RecommendationResult:
+    """Recommendation text plus the movies it was built from"""
+    text: str
+    movies: list = field(default_factory=list)  # every hydrated candidate (MovieInfo)
+    recommended_ids: list = field(default_factory=list)
+    explanations: dict = field(default_factory=dict)  # movie ID -> why it was picked (structured output only)
+    notes: list = field(default_factory=list)  # what is partial or substituted (e.g. a stage ran out of time)
+
+    @property
+    def recommended_movies(self):
+        """The recommended candidates, in recommendation order"""
+        by_id = {movie.id: movie for movie in self.movies}
+        return [by_id[movie_id] for movie_id in self.recommended_ids if movie_id in by_id]
+
+    def __str__(self):
+        return self.text
@@ -0,0 +1,220 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+
+# Default time-to-live in seconds for each cached TMDB endpoint
+DEFAULT_TTLS = {
+    "discover": 6 * 60 * 60,
+    "details": 24 * 60 * 60,
+    "providers": 6 * 60 * 60,
+    # Hydrated movies include watch providers, so they expire with them
+    "movie": 6 * 60 * 60,
+}
+
+
+class MemoryCacheBackend:
+    """In-process LRU cache store (the default backend)"""
+
+    def __init__(self, max_entries=2048):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (found, value) for a key, dropping it if it has expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            if entry[0] < time.time():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, entry[1]
+
+    def set(self, key, value, ttl):
+        """Store a value and evict the least recently used entries beyond max_entries"""
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Remove every entry"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCacheBackend:
+    """On-disk LRU cache store that survives restarts and can be shared by processes on one host.
+
+    Reads only write to the database when an entry has expired or its access time is
+    more than TOUCH_INTERVAL seconds old, so cache hits from several processes don't
+    queue on SQLite's single writer lock.
+    """
+
+    # Seconds an entry's recorded access time may lag behind before a read refreshes it
+    TOUCH_INTERVAL = 60
+
+    def __init__(self, path="cinemood_cache.sqlite3", max_entries=20000, table="cache"):
+        self.path = path
+        self.max_entries = max_entries
+        # Separate caches can share one database file by using different tables
+        self.table = table
+        # sqlite3 connections can't be shared between threads, so each thread opens its own
+        self._local = threading.local()
+
+        with self._connection() as conn:
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+            """)
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_accessed_at ON {self.table} (accessed_at)")
+
+    def _connection(self):
+        """Get this thread's connection, opening it on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            # WAL lets readers in other worker processes proceed while one process writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """Return (found, value) for a key, dropping it if it has expired"""
+        now = time.time()
+        with self._connection() as conn:
+            row = conn.execute(f"SELECT value, expires_at, accessed_at FROM {self.table} WHERE key = ?",
+                               (key,)).fetchone()
+            if row is None:
+                return False, None
+            if row[1] < now:
+                conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+                return False, None
+            if row[2] < now - self.TOUCH_INTERVAL:
+                conn.execute(f"UPDATE {self.table} SET accessed_at = ? WHERE key = ?", (now, key))
+        return True, json.loads(row[0])
+
+    def set(self, key, value, ttl):
+        """Store a value and evict the least recently used entries beyond max_entries"""
+        now = time.time()
+        with self._connection() as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + ttl, now)
+            )
+            # Only scan for the least recently used entries once the table is over its size
+            excess = conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0] - self.max_entries
+            if excess > 0:
+                conn.execute(
+                    f"DELETE FROM {self.table} WHERE key IN "
+                    f"(SELECT key FROM {self.table} ORDER BY accessed_at LIMIT ?)",
+                    (excess,)
+                )
+
+    def clear(self):
+        """Remove every entry"""
+        with self._connection() as conn:
+            conn.execute(f"DELETE FROM {self.table}")
+
+    def __len__(self):
+        return self._connection().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+
+class ResponseCache:
+    """TTL + LRU cache for API responses with per-namespace TTLs and hit/miss counters.
+
+    Cached values are shared between callers, so treat them as read-only.
+    """
+
+    def __init__(self, backend=None, ttls=None, default_ttl=60 * 60, metrics=None):
+        self.backend = backend if backend is not None else MemoryCacheBackend()
+        # Optional Instrumentation that also receives the hit/miss counts
+        self.metrics = metrics
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.default_ttl = default_ttl
+        self.hits = Counter()
+        self.misses = Counter()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(namespace, key_parts):
+        """Build a stable string key from a namespace and JSON-serializable parts"""
+        return f"{namespace}:{json.dumps(key_parts, sort_keys=True, separators=(',', ':'))}"
+
+    @staticmethod
+    def digest(key_parts):
+        """Canonical SHA-256 hash of JSON-serializable parts, for keys built from large inputs"""
+        canonical = json.dumps(key_parts, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, namespace, key_parts):
+        """Return (found, value) and count the lookup as a hit or a miss"""
+        found, value = self.backend.get(self.make_key(namespace, key_parts))
+        with self._lock:
+            if found:
+                self.hits[namespace] += 1
+            else:
+                self.misses[namespace] += 1
+        if self.metrics is not None:
+            self.metrics.count("cache_hits_total" if found else "cache_misses_total", namespace=namespace)
+        return found, value
+
+    def set(self, namespace, key_parts, value):
+        """Store a value with its namespace's TTL"""
+        self.backend.set(self.make_key(namespace, key_parts), value, self.ttls.get(namespace, self.default_ttl))
+
+    def get_or_set(self, namespace, key_parts, loader, refresh=False, validate=None):
+        """Return the cached value, or call loader() and cache its result.
+
+        Exceptions raised by loader() propagate and nothing is cached, so failed
+        requests are retried on the next call; likewise a result for which
+        validate(result) is false is returned but not cached. With refresh=True the
+        cached value is ignored and replaced, restarting its TTL.
+        """
+        if not refresh:
+            found, value = self.get(namespace, key_parts)
+            if found:
+                return value
+
+        value = loader()
+        if validate is None or validate(value):
+            self.set(namespace, key_parts, value)
+        return value
+
+    def stats(self):
+        """Hit/miss counts and hit rate per namespace"""
+        with self._lock:
+            stats = {}
+            for namespace in sorted(set(self.hits) | set(self.misses)):
+                hits, misses = self.hits[namespace], self.misses[namespace]
+                stats[namespace] = {
+                    "hits": hits,
+                    "misses": misses,
+                    "hit_rate": hits / (hits + misses) if hits + misses else 0.0
+                }
+            return stats
+
+    def clear(self):
+        """Empty the cache and reset the counters"""
+        self.backend.clear()
+        with self._lock:
+            self.hits.clear()
+            self.misses.clear()
@@ -0,0 +1,20 @@
+from dataclasses import dataclass, field
+
+
+@dataclass
+class SessionContext:
+    """Per-user state for one recommendation session.
+
+    MoodMovieRecommender itself holds only shared, thread-safe resources (clients,
+    caches, pools); everything that belongs to one user lives here and is passed
+    to each call, so one recommender can serve many sessions at once.
+    """
+    user_profile: dict = field(default_factory=dict)
+    quiz_results: str = ""
+    genre_ids: list = None  # TMDB genre IDs parsed from user_profile, cached on first use (reset it with the profile)
+    fallback_profile: bool = False  # user_profile is the default one, as the AI's couldn't be read (never saved)
+    current_mood: str = ""
+    detailed_movies: list = field(default_factory=list)  # hydrated candidates (MovieInfo) from the last run
+    recommended_movie_ids: list = field(default_factory=list)
+    last_recommendation: object = None  # RecommendationResult from the last run
+    deadline: object = None  # Deadline of the request in progress, if it has one
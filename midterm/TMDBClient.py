@@ -0,0 +1,224 @@
+import asyncio
+import json
+import threading
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from Instrumentation import Instrumentation, endpoint_label
+
+
+def request_key(path, params):
+    """Identity of a GET request: its path and its params in sorted order"""
+    return path, json.dumps(params or {}, sort_keys=True)
+
+
+class _InFlight:
+    """A request being made by one thread, whose result other threads wait for"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class _ThrottledRetry(Retry):
+    """urllib3 Retry that calls throttle() before every retried attempt, so retries wait on the rate limiter too"""
+
+    def __init__(self, *args, throttle=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.throttle = throttle
+
+    def new(self, **kwargs):
+        # urllib3 makes a new Retry for each attempt from the standard settings only
+        retry = super().new(**kwargs)
+        retry.throttle = self.throttle
+        return retry
+
+    def sleep(self, response=None):
+        super().sleep(response)
+        if self.throttle is not None:
+            self.throttle()
+
+
+class TMDBClient:
+    """Shared TMDB HTTP client with connection pooling, keep-alive, retries and timeouts.
+
+    Identical requests made at the same time (same path and params) share one network
+    call, and every attempt, retries included, waits on the optional rate limiter.
+    Callers sharing a response get the same decoded body, so treat it as read-only.
+    """
+
+    def __init__(self, api_key, base_url="https://api.themoviedb.org/3", pool_size=8,
+                 timeout=(3.05, 10), max_retries=3, backoff_factor=0.5, metrics=None, rate_limiter=None):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.metrics = metrics if metrics is not None else Instrumentation()
+        # Optional RateLimiter every request waits on, to stay under TMDB's request rate limit
+        self.rate_limiter = rate_limiter
+        # Requests in progress, keyed by request_key, so identical concurrent requests share one call
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+        # (connect, read) timeout in seconds applied to every call unless overridden
+        self.timeout = timeout
+
+        # Retry rate limiting and transient server errors with exponential backoff,
+        # honouring TMDB's Retry-After header on 429s; each retry also waits on the rate limiter
+        retry = _ThrottledRetry(
+            throttle=self._throttle,
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(["GET"]),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        )
+
+        # One keep-alive pool for the TMDB host, sized so every worker thread gets its own connection
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, path, params=None, timeout=None):
+        """GET a TMDB API path and return the decoded JSON body (raises requests exceptions)"""
+        key = request_key(path, params)
+        with self._in_flight_lock:
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = self._in_flight[key] = _InFlight()
+
+        # Another thread is already making this request: wait for its response
+        if not leader:
+            self.metrics.count("tmdb_coalesced_total", endpoint=endpoint_label(path))
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._get(path, params, timeout)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._in_flight_lock:
+                del self._in_flight[key]
+            call.done.set()
+
+    def _get(self, path, params, timeout):
+        """Make the request for get()"""
+        query = {"api_key": self.api_key}
+        if params:
+            query.update(params)
+
+        self._throttle()
+        with self.metrics.span("tmdb.request", endpoint=endpoint_label(path)):
+            response = self.session.get(f"{self.base_url}{path}", params=query, timeout=timeout or self.timeout)
+
+            # urllib3 records the retries it made on the response
+            retries = getattr(getattr(response.raw, "retries", None), "history", ())
+            if retries:
+                self.metrics.count("tmdb_retries_total", len(retries))
+
+            response.raise_for_status()  # Raise exception for HTTP errors
+            return response.json()
+
+    def _throttle(self):
+        """Wait for the rate limiter (if any) before an attempt"""
+        if self.rate_limiter is not None:
+            waited = self.rate_limiter.acquire()
+            if waited:
+                self.metrics.count("tmdb_throttled_seconds_total", waited)
+
+    def close(self):
+        """Release all pooled connections"""
+        self.session.close()
+
+
+class AsyncTMDBClient:
+    """asyncio counterpart of TMDBClient: one pooled httpx.AsyncClient with the same retries, timeouts and limits"""
+
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, api_key, base_url="https://api.themoviedb.org/3", pool_size=8,
+                 timeout=(3.05, 10), max_retries=3, backoff_factor=0.5, transport=None, metrics=None,
+                 rate_limiter=None):
+        self.api_key = api_key
+        self.metrics = metrics if metrics is not None else Instrumentation()
+        # Optional RateLimiter (which may be shared with a TMDBClient) every attempt waits on
+        self.rate_limiter = rate_limiter
+        # Requests in progress, keyed by request_key, so identical concurrent requests share one call
+        self._in_flight = {}
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        connect_timeout, read_timeout = timeout
+
+        # Requests beyond pool_size wait for a free keep-alive connection instead of opening more
+        self.client = httpx.AsyncClient(
+            base_url=base_url,
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout, pool=None),
+            transport=transport if transport is not None else httpx.AsyncHTTPTransport(retries=max_retries)
+        )
+
+    async def get(self, path, params=None, timeout=None):
+        """GET a TMDB API path and return the decoded JSON body (raises httpx exceptions).
+
+        The request runs in its own task shared by every caller asking for it meanwhile;
+        cancelling one caller doesn't cancel the request for the others.
+        """
+        key = request_key(path, params)
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._get(path, params, timeout))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+        else:
+            self.metrics.count("tmdb_coalesced_total", endpoint=endpoint_label(path))
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        """Done callback: drop a finished request (and mark its error as seen if every caller left)"""
+        del self._in_flight[key]
+        if not task.cancelled():
+            task.exception()
+
+    async def _get(self, path, params, timeout):
+        """Make the request for get()"""
+        query = {"api_key": self.api_key}
+        if params:
+            query.update(params)
+        options = {"timeout": timeout} if timeout else {}
+
+        with self.metrics.span("tmdb.request", endpoint=endpoint_label(path)):
+            # Retry rate limiting and transient server errors with exponential backoff,
+            # honouring TMDB's Retry-After header on 429s
+            for attempt in range(self.max_retries + 1):
+                if self.rate_limiter is not None:
+                    waited = await self.rate_limiter.acquire_async()
+                    if waited:
+                        self.metrics.count("tmdb_throttled_seconds_total", waited)
+                response = await self.client.get(path, params=query, **options)
+                if response.status_code not in self.RETRY_STATUSES or attempt == self.max_retries:
+                    break
+                self.metrics.count("tmdb_retries_total")
+                await asyncio.sleep(self._retry_delay(response, attempt))
+
+            response.raise_for_status()  # Raise exception for HTTP errors
+            return response.json()
+
+    def _retry_delay(self, response, attempt):
+        """Seconds to wait before retrying a response"""
+        retry_after = response.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return float(retry_after)
+        return self.backoff_factor * (2 ** attempt)
+
+    async def aclose(self):
+        """Release all pooled connections"""
+        await self.client.aclose()
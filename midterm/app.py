@@ -1,7 +1,8 @@
-import requests
 import streamlit as st
 
-from MoodMovieRecommender import MoodMovieRecommender
+from CacheWarmer import CacheWarmer
+from MoodMovieRecommender import CACHE_WARM_INTERVAL, PRESET_MOODS, MoodMovieRecommender
+from SessionContext import SessionContext
 
 st.set_page_config(page_title="Mood-Based Movie Recommender", page_icon="🎬")
 
@@ -23,15 +24,21 @@ if not os.getenv("OPENAI_API_KEY"):
     st.stop()
 
 
-# Initialize the recommender
+# Initialize the recommender (shared by every session; per-user state lives in st.session_state.context)
 @st.cache_resource
 def get_recommender():
-    return MoodMovieRecommender()
+    recommender = MoodMovieRecommender()
+    # Keep the preset-mood queries warm in the cache so those clicks skip TMDB
+    if CACHE_WARM_INTERVAL > 0:
+        CacheWarmer(recommender, interval=CACHE_WARM_INTERVAL).start()
+    return recommender
 
 
 recommender = get_recommender()
 
 # App state
+if 'context' not in st.session_state:
+    st.session_state.context = SessionContext()
 if 'quiz_completed' not in st.session_state:
     st.session_state.quiz_completed = False
 if 'profile' not in st.session_state:
@@ -40,6 +47,19 @@ if 'recommendations' not in st.session_state:
     st.session_state.recommendations = None
 if 'streaming_info' not in st.session_state:
     st.session_state.streaming_info = None
+if 'trace' not in st.session_state:
+    st.session_state.trace = None
+
+# Per-request timing and token breakdown, for debugging slow recommendations
+show_trace = st.sidebar.checkbox("Show debug trace")
+
+# Returning users get their saved profile back instead of retaking the quiz
+user_id = st.sidebar.text_input("User ID (optional, remembers your profile)").strip()
+if user_id and st.session_state.get("loaded_user_id") != user_id:
+    st.session_state.loaded_user_id = user_id
+    if not st.session_state.quiz_completed and recommender.load_profile(user_id, context=st.session_state.context):
+        st.session_state.profile = st.session_state.context.quiz_results
+        st.session_state.quiz_completed = True
 
 # Quiz section
 if not st.session_state.quiz_completed:
@@ -64,10 +84,14 @@ if not st.session_state.quiz_completed:
                 "q5": q5, "q6": q6, "q7": q7, "q8": q8
             }
 
-            with st.spinner("Analyzing your movie personality..."):
-                recommender._analyze_quiz_results(answers)
-                st.session_state.profile = recommender.quiz_results
-                st.session_state.quiz_completed = True
+            context = st.session_state.context
+            # Reuse the saved profile for identical answers; otherwise show the summary as it is written
+            if not recommender.load_profile(answers=answers, context=context):
+                with st.spinner("Analyzing your movie personality..."):
+                    st.write_stream(recommender.analyze_quiz_results_stream(answers, context))
+            recommender.save_profile(user_id, answers, context)
+            st.session_state.profile = context.quiz_results
+            st.session_state.quiz_completed = True
             st.rerun()
 
 # Mood and recommendations section
@@ -82,11 +106,12 @@ else:
         st.session_state.profile = None
         st.session_state.recommendations = None
         st.session_state.streaming_info = None
+        st.session_state.context = SessionContext()
         st.experimental_rerun()
 
     # Mood input
     st.header("How are you feeling today?")
-    mood_options = ["Happy", "Sad", "Relaxed", "Excited", "Bored", "Stressed", "Thoughtful", "Nostalgic", "Other"]
+    mood_options = PRESET_MOODS + ["Other"]
     selected_mood = st.selectbox("Select your mood", mood_options)
 
     if selected_mood == "Other":
@@ -96,42 +121,58 @@ else:
         mood = selected_mood
 
     if st.button("Get Recommendations") and mood:
-        with st.spinner("Finding perfect movies for your mood using TMDB data..."):
-            recommender.current_mood = mood
+        # Live preview of the recommendations while they are written
+        live_output = st.empty()
+        with st.spinner("Finding perfect movies for your mood using TMDB data..."), \
+                recommender.metrics.trace("recommend") as trace:
+            context = st.session_state.context
+            context.current_mood = mood
+            # One latency budget (if configured) for the recommendation and its watch providers
+            deadline = recommender.start_deadline()
 
             # Generate recommendations
-            recommendations = recommender.recommend_movies()
+            with live_output.container():
+                st.header("Your Personalized Recommendations")
+                st.write_stream(recommender.recommend_movies_stream(context, deadline))
+            recommendations = context.last_recommendation
             st.session_state.recommendations = recommendations
 
             # Get streaming availability
-            streaming_info = recommender.get_streaming_availability(recommendations)
+            streaming_info = recommender.get_streaming_availability(recommendations, context, deadline=deadline)
             st.session_state.streaming_info = streaming_info
 
+        # The stored result is rendered below, so drop the preview
+        live_output.empty()
+        st.session_state.trace = trace.to_dict()
+        st.session_state.trace_summary = trace.summary()
+
     # Display recommendations if available
     if st.session_state.recommendations:
         st.header("Your Personalized Recommendations")
-        st.write(st.session_state.recommendations)
+        st.write(st.session_state.recommendations.text)
+        # Say what is partial when a stage ran out of time
+        for note in st.session_state.recommendations.notes:
+            st.caption(note)
 
         st.header("Where to Watch")
         st.write(st.session_state.streaming_info)
 
-        # Add posters for visual appeal if we have movie IDs
-        if hasattr(recommender, "recommended_movie_ids") and recommender.recommended_movie_ids:
+        # Add posters for visual appeal, straight from the details fetched during recommendation
+        recommended_movies = st.session_state.recommendations.recommended_movies[:5]
+        if recommended_movies:
             st.header("Movie Posters")
-            cols = st.columns(min(5, len(recommender.recommended_movie_ids)))
-
-            for i, movie_id in enumerate(recommender.recommended_movie_ids[:5]):
-                poster_path = None
-                response = requests.get(
-                    f"{recommender.tmdb_base_url}/movie/{movie_id}?api_key={recommender.tmdb_api_key}"
-                )
-                if response.status_code == 200:
-                    movie_data = response.json()
-                    if "poster_path" in movie_data and movie_data["poster_path"]:
-                        poster_path = f"https://image.tmdb.org/t/p/w500{movie_data['poster_path']}"
+            cols = st.columns(len(recommended_movies))
 
+            for i, movie in enumerate(recommended_movies):
                 with cols[i]:
-                    if poster_path:
-                        st.image(poster_path, width=150)
+                    if movie.poster_url:
+                        st.image(movie.poster_url, width=150)
                     else:
-                        st.write("No poster available")
\ No newline at end of file
+                        st.write("No poster available")
+
+    if show_trace and st.session_state.trace:
+        with st.expander("Debug trace"):
+            st.write(f"Total: {st.session_state.trace['duration_ms']:.0f} ms")
+            st.table(st.session_state.trace_summary)
+            st.write(st.session_state.trace["counters"])
+            st.json(st.session_state.trace["spans"], expanded=False)
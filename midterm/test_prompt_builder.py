@@ -0,0 +1,37 @@
+import pytest
+
+from PromptBuilder import PromptBuilder, count_tokens
+from RecommendationResult import MovieInfo
+
+INSTRUCTIONS = """
+Select the 5 movies that would best match both their taste profile and current mood.
+Format your response as a numbered list.
+"""
+
+
+def make_movies(count):
+    genres = [[18, 35], [28, 12, 878], [27, 53, 9648], [16, 10751], [36, 10752], [10749, 10402], [80, 37]]
+    return [MovieInfo(id=i, title=f"Film {i}", year=str(1950 + i), director=f"Director {i}",
+                      overview=f"A story about character {i} and what happens next. " * 6,
+                      genres=[], vote_average=6.5, genre_ids=genres[i % len(genres)])
+            for i in range(count)]
+
+
+@pytest.mark.parametrize("budget", [200, 300, 450, 600, 900, 2500])
+def test_prompt_stays_within_budget(budget):
+    builder = PromptBuilder(token_budget=budget)
+    profile = {"preferred_genres": [{"id": 18, "name": "Drama"}], "decade_preference": "modern"}
+
+    prompt, movies, tokens = builder.build(profile, "happy", make_movies(40), INSTRUCTIONS)
+
+    assert tokens == count_tokens(prompt)
+    assert tokens <= budget
+    assert movies
+
+
+def test_all_candidates_kept_when_they_fit():
+    movies = make_movies(3)
+    prompt, included, tokens = PromptBuilder(token_budget=5000).build({}, "sad", movies, INSTRUCTIONS)
+
+    assert included == movies
+    assert "Genres: " in prompt